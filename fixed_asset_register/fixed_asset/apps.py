@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class FixedAssetConfig(AppConfig):
     name = 'fixed_asset'
+
+    def ready(self):
+        from . import escalation, policies  # noqa: F401  register the cache invalidation signals
@@ -0,0 +1,147 @@
+import os
+import random
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from .models import FixedAssetRegister, LeaseFinancial
+from .services.depreciation import (
+    double_declining,
+    get_elapsed_units,
+    get_total_units,
+    reducing_balance,
+    straight_line,
+)
+
+UNITS = ['DAY', 'MONTH', 'YEAR']
+# Cases are generated and depreciated as of a fixed date, so every run
+# measures the same workload as the committed baseline.
+BENCHMARK_AS_OF = date(2025, 6, 30)
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+METHODS = ['Straight Line', 'Reducing Balance', 'Double Declining']
+
+
+def _asset_params(rng, today):
+    total_amount = round(10 ** rng.uniform(3, 8), 2)
+    useful_life = rng.randint(1, 50)
+    computation = rng.choice(UNITS)
+    capitalization_date = today - timedelta(days=rng.randint(0, useful_life * 365))
+    return {
+        'depreciation_method': rng.choice(METHODS),
+        'total_amount': total_amount,
+        'residual_value': round(total_amount * rng.choice([0.01, 0.05, 0.1, 0.2]), 2),
+        'useful_life': useful_life,
+        'period': 'YEAR',
+        'computation': computation,
+        'capitalization_date': datetime.combine(capitalization_date, datetime.min.time()),
+    }
+
+
+def _lease(rng, today):
+    lease_term = rng.randint(1, 30)
+    start_date = today - timedelta(days=rng.randint(0, 3650))
+    changing_date = None
+    if rng.random() < 0.3:
+        changing_date = start_date + timedelta(days=rng.randint(30, lease_term * 365))
+    lease = LeaseFinancial(
+        contract_amount=Decimal('0'),
+        deposit=Decimal('0'),
+        down_payment=Decimal(str(round(rng.uniform(0, 50000), 2))),
+        other_cost=Decimal('0'),
+        dismantling_cost=Decimal('0'),
+        start_date=start_date,
+        end_date=start_date + timedelta(days=lease_term * 365),
+        lease_term=lease_term,
+        lease_period='Year',
+        discount_rate=rng.uniform(2, 15),
+        payment_frequency=Decimal(str(round(rng.uniform(500, 20000), 2))),
+        payment_period='Monthly',
+        computation=rng.choice(['Monthly', 'Yearly']),
+        changing_date=changing_date,
+        changing_amount=Decimal(str(round(rng.uniform(500, 25000), 2))),
+        payment_timing=rng.choice(['Advance', 'Arrears']),
+        discount_rate_type='IBR',
+        escalation_type='None',
+    )
+    lease.present_value = lease.get_calculated_pv()
+    return lease
+
+
+def _depreciation_args(params, as_of):
+    total_units = get_total_units(params['useful_life'], params['period'], params['computation'])
+    elapsed_units = min(get_elapsed_units(params['capitalization_date'], params['computation'], as_of), total_units)
+    return (
+        Decimal(str(params['total_amount'])),
+        Decimal(str(params['residual_value'])),
+        params,
+        total_units,
+        elapsed_units,
+    )
+
+
+def build_cases(sample_size=500, seed=1234, as_of=BENCHMARK_AS_OF):
+    rng = random.Random(seed)
+    assets = [_asset_params(rng, as_of) for _ in range(sample_size)]
+    args = [_depreciation_args(params, as_of) for params in assets]
+    registers = [FixedAssetRegister(asset_status='Ready to Use', **params) for params in assets]
+    leases = [_lease(rng, as_of) for _ in range(max(sample_size // 10, 1))]
+
+    return {
+        'get_total_units': (
+            assets, lambda p: get_total_units(p['useful_life'], p['period'], p['computation'])
+        ),
+        'get_elapsed_units': (
+            assets, lambda p: get_elapsed_units(p['capitalization_date'], p['computation'], as_of)
+        ),
+        'straight_line': (
+            args, lambda a: straight_line(a[0], a[1], a[3], a[4])
+        ),
+        'reducing_balance': (
+            args, lambda a: reducing_balance(a[0], a[1], a[2]['useful_life'], a[4], a[2]['computation'])
+        ),
+        'double_declining': (
+            args, lambda a: double_declining(a[0], a[1], a[2]['useful_life'], a[4], a[2]['computation'])
+        ),
+        'calculate_current_nbv': (
+            registers, lambda register: register.calculate_current_nbv(as_of)
+        ),
+        'lease_calculated_pv': (
+            leases, lambda lease: lease.get_calculated_pv()
+        ),
+        'lease_amortization_schedule': (
+            leases, lambda lease: lease.get_amortization_schedule()
+        ),
+        'lease_amortization_columns': (
+            leases, lambda lease: lease.get_amortization_columns()
+        ),
+    }
+
+
+def measure(items, func, min_time=0.5):
+    operations = 0
+    start = time.perf_counter()
+    while True:
+        for item in items:
+            func(item)
+        operations += len(items)
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            return operations / elapsed
+
+
+def run_benchmarks(names=None, sample_size=500, min_time=0.5, seed=1234):
+    cases = build_cases(sample_size, seed)
+    return {
+        name: measure(items, func, min_time)
+        for name, (items, func) in cases.items()
+        if not names or name in names
+    }
+
+
+def find_regressions(results, baseline, threshold=0.2):
+    regressions = {}
+    for name, ops_per_sec in results.items():
+        expected = baseline.get(name)
+        if expected and ops_per_sec < expected * (1 - threshold):
+            regressions[name] = (expected, ops_per_sec)
+    return regressions
@@ -0,0 +1,31 @@
+from threading import RLock
+import time
+
+
+class TimedCache:
+    # In-process cache of a few tables, reloaded on first use after clear()
+    # or once it is older than ttl seconds. Signals only reach the process
+    # that saved, so the ttl is what eventually refreshes the other workers.
+    ttl = 300
+
+    def __init__(self):
+        self._lock = RLock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._loaded_at = None
+            self.reset()
+
+    def reset(self):
+        raise NotImplementedError
+
+    def refresh(self):
+        raise NotImplementedError
+
+    def _load(self):
+        with self._lock:
+            if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl:
+                return
+            self.refresh()
+            self._loaded_at = time.monotonic()
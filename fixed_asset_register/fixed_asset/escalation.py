@@ -0,0 +1,111 @@
+from bisect import bisect_right
+from decimal import Decimal
+from functools import lru_cache
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .caching import TimedCache
+from .models import CPIIndex
+from .services.lease import first_changed_period, payment_runs, percent_factors
+
+INDEX_CACHE_SECONDS = 300
+
+
+class CPIIndexCache(TimedCache):
+    ttl = INDEX_CACHE_SECONDS
+
+    def reset(self):
+        self._months = []
+        self._values = []
+
+    def refresh(self):
+        rows = CPIIndex.objects.order_by('period').values_list('period', 'value')
+        self._months = [period.year * 12 + period.month - 1 for period, _ in rows]
+        self._values = [value for _, value in rows]
+
+    def _value_at(self, month):
+        # The latest published value on or before the month.
+        index = bisect_right(self._months, month) - 1
+        return self._values[index] if index >= 0 else None
+
+    def ratios(self, start_date, years):
+        # Index at each lease anniversary over the index at commencement;
+        # None when the index has no value for the commencement month.
+        self._load()
+        start = start_date.year * 12 + start_date.month - 1
+        base = self._value_at(start)
+        if not base:
+            return None
+        return tuple(self._value_at(start + 12 * year) / base for year in range(years))
+
+
+cpi_index = CPIIndexCache()
+
+
+def cpi_factors(lease):
+    # The lease's escalation ratios from the index as currently loaded.
+    is_yearly, _, total_periods, _ = lease.get_payment_terms()
+    years = total_periods if is_yearly else -(-total_periods // 12)
+    return cpi_index.ratios(lease.start_date, years)
+
+
+@lru_cache(maxsize=16384)
+def _compiled_runs(total_periods, step_months, payment, changing_amount, changed_from, escalation_type,
+                   escalation_rate, index_factors):
+    periods_per_year = 12 // step_months
+    years = -(-total_periods // periods_per_year)
+
+    factors = None
+    if escalation_type == 'Percent' and escalation_rate:
+        factors = percent_factors(escalation_rate, years)
+    elif escalation_type == 'CPI':
+        factors = index_factors
+    return payment_runs(total_periods, payment, changing_amount, changed_from, factors, periods_per_year)
+
+
+def compile_payment_runs(lease):
+    # CPI leases escalate by the ratios pinned when they were last measured
+    # (see LeaseFinancial.pin_escalation_factors), so their stored PV and
+    # schedules hold when the index is republished; unsaved ones use the
+    # index as loaded.
+    is_yearly, _, total_periods, change_at_period = lease.get_payment_terms()
+    index_factors = None
+    if lease.escalation_type == 'CPI':
+        if lease.escalation_factors is not None:
+            index_factors = tuple(Decimal(value) for value in lease.escalation_factors)
+        else:
+            index_factors = cpi_factors(lease)
+    return _compiled_runs(
+        total_periods,
+        12 if is_yearly else 1,
+        Decimal(str(lease.payment_frequency)),
+        Decimal(str(lease.changing_amount)),
+        first_changed_period(change_at_period, total_periods),
+        lease.escalation_type,
+        lease.escalation_rate,
+        index_factors,
+    )
+
+
+def first_republished_year(lease):
+    # (first lease year whose ratio differs from the pinned one, ratios now);
+    # year is None when the index change does not reach the lease.
+    current = cpi_factors(lease)
+    current = None if current is None else [str(factor) for factor in current]
+    pinned = lease.escalation_factors
+    if current == pinned:
+        return None, current
+    if current is None or pinned is None:
+        return 0, current
+    changed = [year for year, (old, new) in enumerate(zip(pinned, current)) if old != new]
+    return (changed[0] if changed else min(len(pinned), len(current))), current
+
+
+@receiver(post_save, sender=CPIIndex)
+@receiver(post_delete, sender=CPIIndex)
+def invalidate_cpi_index(sender, **kwargs):
+    # Runs are keyed on the factors themselves, so only the index reloads;
+    # saved leases keep their pinned ratios until remeasured
+    # (remeasure_cpi_leases).
+    cpi_index.clear()
@@ -0,0 +1,51 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from fixed_asset.benchmarks import BASELINE_PATH, find_regressions, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = "Measure ops/sec of the depreciation and lease calculations and compare them with a baseline."
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help='Only run these benchmarks.')
+        parser.add_argument('--sample-size', type=int, default=500)
+        parser.add_argument('--min-time', type=float, default=0.5, help='Seconds to run each benchmark for.')
+        parser.add_argument('--seed', type=int, default=1234)
+        parser.add_argument('--baseline', default=BASELINE_PATH,
+                            help='JSON file of ops/sec to compare against, defaults to the committed baseline.')
+        parser.add_argument('--no-baseline', dest='baseline', action='store_const', const=None,
+                            help='Only report, without comparing.')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Allowed slowdown against the baseline, as a fraction.')
+        parser.add_argument('--save', help='Write the results to this JSON file.')
+
+    def handle(self, *args, **options):
+        results = run_benchmarks(
+            names=options['names'],
+            sample_size=options['sample_size'],
+            min_time=options['min_time'],
+            seed=options['seed'],
+        )
+
+        for name, ops_per_sec in results.items():
+            self.stdout.write(f"{name:<30} {ops_per_sec:>14,.0f} ops/sec")
+
+        if options['save']:
+            with open(options['save'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+
+            regressions = find_regressions(results, baseline, options['threshold'])
+            for name, (expected, actual) in regressions.items():
+                self.stderr.write(f"{name}: {actual:,.0f} ops/sec, baseline {expected:,.0f} ops/sec")
+            if regressions:
+                raise CommandError(
+                    f"{len(regressions)} benchmark(s) regressed more than {options['threshold']:.0%}"
+                )
+
+        self.stdout.write(self.style.SUCCESS("Benchmarks finished"))
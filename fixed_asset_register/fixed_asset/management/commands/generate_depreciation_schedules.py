@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from fixed_asset.models import FixedAssetRegister, get_default_convention
+
+
+class Command(BaseCommand):
+    help = "Build the persisted depreciation schedule for assets that don't have one."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Rebuild every schedule, not just missing ones.')
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        queryset = FixedAssetRegister.objects.order_by('register_id')
+        if not options['all']:
+            queryset = queryset.filter(depreciation_schedule__isnull=True)
+
+        convention = get_default_convention()
+        generated = 0
+        for asset in queryset.iterator(chunk_size=options['chunk_size']):
+            asset.regenerate_depreciation_schedule(convention)
+            generated += 1
+            if generated % options['chunk_size'] == 0:
+                self.stdout.write(f"Generated {generated} schedules")
+
+        self.stdout.write(self.style.SUCCESS(f"Generated {generated} schedules"))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from fixed_asset.models import LeaseFinancial
+
+
+class Command(BaseCommand):
+    help = "Build the persisted amortization and ROU schedules for leases that don't have them."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        # Only missing ones: rebuilding a stored schedule from the current
+        # terms would drop the periods kept through a remeasurement.
+        queryset = LeaseFinancial.objects.filter(lease_term__gt=0, amortization_rows__isnull=True).order_by('pk')
+
+        generated = 0
+        for lease in queryset.iterator(chunk_size=options['chunk_size']):
+            lease.backfill_schedules()
+            generated += 1
+            if generated % options['chunk_size'] == 0:
+                self.stdout.write(f"Generated {generated} schedules")
+
+        self.stdout.write(self.style.SUCCESS(f"Generated {generated} schedules"))
@@ -0,0 +1,35 @@
+from datetime import date, datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from fixed_asset.services.lease_close import post_lease_journals
+
+
+class Command(BaseCommand):
+    help = "Post lease interest, liability and ROU depreciation journals for a period to the general ledger."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Period end (YYYY-MM-DD), defaults to today.')
+        parser.add_argument('--from', dest='period_start',
+                            help='Period start (YYYY-MM-DD), defaults to the first of the period end month.')
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def parse_date(self, value, option):
+        try:
+            return datetime.strptime(value, '%Y-%m-%d').date()
+        except ValueError:
+            raise CommandError(f'{option} must be in YYYY-MM-DD format')
+
+    def handle(self, *args, **options):
+        period_end = self.parse_date(options['date'], '--date') if options['date'] else date.today()
+        period_start = self.parse_date(options['period_start'], '--from') if options['period_start'] else None
+        if period_start and period_start > period_end:
+            raise CommandError('--from must not be after --date')
+
+        report = post_lease_journals(period_end, period_start, options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Posted {report['created']} journal lines for {report['periods']} periods of {report['leases']} leases "
+            f"({report['skipped']} already posted, {report['regenerated']} lease schedules regenerated): "
+            f"interest {report['interest']}, "
+            f"payments {report['payments']}, ROU depreciation {report['depreciation']}"
+        ))
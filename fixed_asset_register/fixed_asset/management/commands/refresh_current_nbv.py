@@ -0,0 +1,68 @@
+import json
+import os
+from datetime import date, datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from fixed_asset.services.depreciation_runs import refresh_current_nbv
+
+
+class Command(BaseCommand):
+    help = "Recompute current_nbv for the whole register and store the rows that drifted."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='NBV date (YYYY-MM-DD), defaults to today.')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('--checkpoint', default=os.path.join(settings.BASE_DIR, 'refresh_current_nbv.checkpoint'),
+                            help='File recording progress so an interrupted run resumes where it stopped.')
+        parser.add_argument('--restart', action='store_true', help='Ignore an existing checkpoint.')
+
+    def read_checkpoint(self, path, as_of):
+        if not os.path.exists(path):
+            return None
+        with open(path) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+        # A checkpoint from another day is stale: those rows need today's NBV.
+        if checkpoint.get('as_of') != as_of.isoformat():
+            return None
+        return checkpoint
+
+    def write_checkpoint(self, path, checkpoint):
+        temporary = f"{path}.tmp"
+        with open(temporary, 'w') as checkpoint_file:
+            json.dump(checkpoint, checkpoint_file)
+        os.replace(temporary, path)
+
+    def handle(self, *args, **options):
+        as_of = date.today()
+        if options['date']:
+            try:
+                as_of = datetime.strptime(options['date'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('--date must be in YYYY-MM-DD format')
+
+        path = options['checkpoint']
+        checkpoint = None if options['restart'] else self.read_checkpoint(path, as_of)
+        if checkpoint:
+            self.stdout.write(f"Resuming after register {checkpoint['last_id']}")
+        else:
+            checkpoint = {'as_of': as_of.isoformat(), 'last_id': 0, 'scanned': 0, 'updated': 0}
+
+        scanned, updated = checkpoint['scanned'], checkpoint['updated']
+        for last_id, page_scanned, page_updated in refresh_current_nbv(
+            as_of, options['chunk_size'], checkpoint['last_id']
+        ):
+            checkpoint.update(
+                last_id=last_id, scanned=scanned + page_scanned, updated=updated + page_updated
+            )
+            self.write_checkpoint(path, checkpoint)
+            self.stdout.write(
+                f"Scanned {checkpoint['scanned']} assets, updated {checkpoint['updated']} (last register {last_id})"
+            )
+
+        if os.path.exists(path):
+            os.remove(path)
+        self.stdout.write(self.style.SUCCESS(
+            f"Refreshed NBV as of {as_of}: scanned {checkpoint['scanned']} assets, updated {checkpoint['updated']}"
+        ))
@@ -0,0 +1,24 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+
+from fixed_asset.models import LeaseFinancial
+
+
+class Command(BaseCommand):
+    help = "Remeasure CPI-escalated leases whose index ratios changed since they were last measured."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        queryset = LeaseFinancial.objects.filter(escalation_type='CPI').order_by('pk')
+
+        outcomes = Counter()
+        for lease in queryset.iterator(chunk_size=options['chunk_size']):
+            outcomes[lease.remeasure_for_index() or 'unchanged'] += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {sum(outcomes.values())} CPI leases: {outcomes['remeasured']} remeasured, "
+            f"{outcomes['regenerated']} regenerated, {outcomes['unchanged']} unchanged"
+        ))
@@ -0,0 +1,75 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from fixed_asset.services.depreciation_runs import (
+    preview_period_depreciation,
+    run_parallel_depreciation,
+    run_period_depreciation,
+    stream_depreciation_preview,
+)
+
+
+class Command(BaseCommand):
+    help = "Post period-end depreciation for every 'Ready to Use' asset."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Depreciation date (YYYY-MM-DD), defaults to today.')
+        parser.add_argument('--user', type=int, help='Users.id recorded on the audit log.')
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of worker processes; more than 1 partitions the register.')
+        parser.add_argument('--partition-by', choices=['account', 'range'], default='account')
+        parser.add_argument('--journal', action='store_true', help='Mark the postings for the journal.')
+        parser.add_argument('--incremental', action='store_true',
+                            help='Carry each asset forward from its last posted depreciation event.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Write the postings the run would make to stdout instead of saving them.')
+        parser.add_argument('--format', choices=['ndjson', 'csv'], default='ndjson',
+                            help='Output format for --dry-run.')
+
+    def handle(self, *args, **options):
+        depreciation_date = None
+        if options['date']:
+            try:
+                depreciation_date = datetime.strptime(options['date'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('--date must be in YYYY-MM-DD format')
+
+        if options['dry_run']:
+            rows = preview_period_depreciation(
+                depreciation_date=depreciation_date,
+                chunk_size=options['chunk_size'],
+                incremental=options['incremental'],
+            )
+            for line in stream_depreciation_preview(rows, options['format']):
+                self.stdout.write(line, ending='')
+            return
+
+        if options['workers'] > 1:
+            report = run_parallel_depreciation(
+                user_id=options['user'],
+                depreciation_date=depreciation_date,
+                partition_by=options['partition_by'],
+                workers=options['workers'],
+                chunk_size=options['chunk_size'],
+                show_in_journal=options['journal'],
+                incremental=options['incremental'],
+            )
+        else:
+            report = run_period_depreciation(
+                user_id=options['user'],
+                depreciation_date=depreciation_date,
+                chunk_size=options['chunk_size'],
+                show_in_journal=options['journal'],
+                incremental=options['incremental'],
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {report['processed']} assets in {report['chunks']} chunks, "
+            f"{report['finished']} finished, total depreciation {report['total_depreciation']}"
+        ))
+        for skipped in report['skipped']:
+            self.stdout.write(f"Skipped {skipped['register_id']}: {skipped['reason']}")
+        for failed in report.get('failed_partitions', []):
+            self.stderr.write(f"Partition {failed['partition']} failed: {failed['error']}")
@@ -0,0 +1,143 @@
+from collections import namedtuple
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .caching import TimedCache
+from .models import (
+    AssetBook,
+    AssetCategoryPolicy,
+    BookLevelPolicy,
+    Category,
+    ConventionList,
+    SystemDefault,
+)
+
+POLICY_CACHE_SECONDS = 300
+
+ResolvedPolicy = namedtuple('ResolvedPolicy', [
+    'book_id',
+    'book_name',
+    'book_level',
+    'category_id',
+    'convention',
+    'overrides',
+    'depreciation_frequency',
+    'posting_date_rule',
+    'rounding_precision',
+    'prevent_negative_NBV',
+    'stop_at_residual_value',
+    'period_lock_required',
+    'allow_posting_to_closed_period',
+    'depreciation_start_rule',
+])
+
+
+def _resolve(book_policy, category_policy=None):
+    # SystemDefault -> BookLevelPolicy -> AssetCategoryPolicy, the most
+    # specific value that is set wins.
+    system_default = book_policy.default
+    depreciation_frequency = book_policy.depreciation_frequency or system_default.depreciation_frequency
+    rounding_precision = book_policy.rounding_precision
+    if rounding_precision is None:
+        rounding_precision = system_default.rounding_precision
+
+    convention = book_policy.get_proration_table()
+    overrides = ()
+    if category_policy is not None:
+        convention = category_policy.get_proration_table()
+        overrides = tuple(sorted(category_policy.get_register_overrides().items()))
+        depreciation_frequency = category_policy.depreciation_frequency or depreciation_frequency
+
+    return ResolvedPolicy(
+        book_id=book_policy.book_id,
+        book_name=book_policy.book.book_name,
+        book_level=book_policy.book_level,
+        category_id=category_policy.category_id if category_policy is not None else None,
+        convention=convention,
+        overrides=overrides,
+        depreciation_frequency=depreciation_frequency,
+        posting_date_rule=book_policy.posting_date_rule or system_default.posting_date_rule,
+        rounding_precision=rounding_precision,
+        prevent_negative_NBV=book_policy.prevent_negative_NBV,
+        stop_at_residual_value=book_policy.stop_at_residual_value,
+        period_lock_required=book_policy.period_lock_required,
+        allow_posting_to_closed_period=book_policy.allow_posting_to_closed_period,
+        depreciation_start_rule=book_policy.depreciation_start_rule or system_default.depreciation_start_rule,
+    )
+
+
+class PolicyResolver(TimedCache):
+    ttl = POLICY_CACHE_SECONDS
+
+    def reset(self):
+        self._books = {}
+        self._policies = {}
+        self._categories = {}
+        self._default_convention = None
+
+    def refresh(self):
+        system_default = SystemDefault.objects.order_by('-default_id').first()
+        book_policies = list(
+            BookLevelPolicy.objects.select_related('book', 'default', 'convention')
+            .filter(book__isActive=True).order_by('book_id')
+        )
+        categories = {}
+        for category_id, code, name in Category.objects.values_list('category_id', 'category_code', 'category_name'):
+            categories.setdefault(name, category_id)
+            categories[code] = category_id
+
+        books = {}
+        policies = {}
+        for book_policy in book_policies:
+            books[book_policy.book_id] = _resolve(book_policy)
+            policies[(book_policy.book_id, None)] = books[book_policy.book_id]
+        by_pk = {book_policy.pk: book_policy for book_policy in book_policies}
+        for category_policy in AssetCategoryPolicy.objects.filter(book_level_policy__in=book_policies):
+            book_policy = by_pk[category_policy.book_level_policy_id]
+            category_policy.book_level_policy = book_policy
+            policies[(book_policy.book_id, category_policy.category_id)] = _resolve(book_policy, category_policy)
+
+        self._default_convention = system_default.get_proration_table() if system_default else None
+        self._books = books
+        self._policies = policies
+        self._categories = categories
+
+    def default_convention(self):
+        self._load()
+        return self._default_convention
+
+    def book_ids(self):
+        self._load()
+        return list(self._books)
+
+    def category_for(self, code_or_name):
+        self._load()
+        return self._categories.get(code_or_name)
+
+    def resolve(self, book_id, category_id=None):
+        # Falls back to the book's own policy when the category has none.
+        self._load()
+        policy = self._policies.get((book_id, category_id))
+        if policy is None:
+            policy = self._books.get(book_id)
+        return policy
+
+
+policy_resolver = PolicyResolver()
+
+
+@receiver(post_save, sender=SystemDefault)
+@receiver(post_delete, sender=SystemDefault)
+@receiver(post_save, sender=AssetBook)
+@receiver(post_delete, sender=AssetBook)
+@receiver(post_save, sender=BookLevelPolicy)
+@receiver(post_delete, sender=BookLevelPolicy)
+@receiver(post_save, sender=AssetCategoryPolicy)
+@receiver(post_delete, sender=AssetCategoryPolicy)
+@receiver(post_save, sender=ConventionList)
+@receiver(post_delete, sender=ConventionList)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_policy_cache(sender, **kwargs):
+    policy_resolver.clear()
@@ -171,6 +171,11 @@ class DepreciationSerializer(serializers.ModelSerializer):
         model = Depreciation
         fields = '__all__'
 
+class DepreciationScheduleSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DepreciationSchedule
+        fields = '__all__'
+
 class AssetPolicySerializer(serializers.ModelSerializer):
     class Meta:
         model = AssetPolicy
@@ -245,6 +250,12 @@ class ResetPasswordSerializer(serializers.Serializer):
     token = serializers.UUIDField()
     new_password = serializers.CharField(min_length=6)
 
+class PeriodEndDepreciationSerializer(serializers.Serializer):
+    # Flags arrive as JSON booleans or as form strings like "false" / "0".
+    dry_run = serializers.BooleanField(default=False)
+    incremental = serializers.BooleanField(default=False)
+    show_in_journal = serializers.BooleanField(default=False)
+
 class AssetBookSerializer(serializers.ModelSerializer):
     class Meta:
         model = AssetBook
@@ -275,18 +286,41 @@ class AssetCategoryPolicySerializer(serializers.ModelSerializer):
         model = AssetCategoryPolicy
         fields = '__all__'
     
+class CPIIndexSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CPIIndex
+        fields = '__all__'
+
 class LeaseFinancialSerializer(serializers.ModelSerializer):
+    # Schedules are only embedded on request, e.g. ?include=schedule,rou_schedule
+    INCLUDES = {'schedule': 'amortization_schedule', 'rou_schedule': 'rou_asset_schedule'}
+
     amortization_schedule = serializers.SerializerMethodField()
+    rou_asset_schedule = serializers.SerializerMethodField()
     class Meta:
         model = LeaseFinancial
         fields = '__all__'
 
+    @classmethod
+    def requested_includes(cls, request):
+        if request is None:
+            return set()
+        return {cls.INCLUDES[name] for name in request.query_params.get('include', '').split(',') if name in cls.INCLUDES}
+
+    def get_fields(self):
+        fields = super().get_fields()
+        requested = self.requested_includes(self.context.get('request'))
+        for field in self.INCLUDES.values():
+            if field not in requested:
+                fields.pop(field)
+        return fields
+
     def get_amortization_schedule(self, obj):
         
-        return obj.get_amortization_schedule()
+        return obj.get_stored_amortization_schedule()
     
     def get_rou_asset_schedule(self, obj):
-        return obj.get_rou_asset_schedule()
+        return obj.get_stored_rou_asset_schedule()
 
 
 
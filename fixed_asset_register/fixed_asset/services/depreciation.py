@@ -1,6 +1,19 @@
-from decimal import Decimal
+from decimal import Decimal, ROUND_FLOOR
 from datetime import date, datetime
 from dateutil.relativedelta import relativedelta
+from functools import lru_cache
+import numpy as np
+
+from .proration import (
+    _as_date_array,
+    _date_parts,
+    _days_in_month,
+    prorated_units,
+    prorated_units_array,
+)
+
+DEPRECIATION_CACHE_SIZE = 4096
+
 
 def get_total_units(useful_life, period, computation):
     if useful_life <= 0:
@@ -28,11 +41,13 @@ def get_total_units(useful_life, period, computation):
 
 
 
-def get_elapsed_units(capitalization_date, computation):
+def get_elapsed_units(capitalization_date, computation, as_of=None):
     if not capitalization_date:
         return 0
 
-    today = date.today()
+    today = as_of or date.today()
+    if isinstance(today, datetime):
+        today = today.date()
 
     if isinstance(capitalization_date, datetime):
         capitalization_date = capitalization_date.date()
@@ -62,60 +77,488 @@ def straight_line(total_amount, residual_value, total_units, elapsed_units):
 
 
 
-def reducing_balance(total_amount, residual_value, useful_life, elapsed_units, computation):
-    cost = Decimal(str(total_amount))
-    residual = Decimal(str(residual_value))
-
-    if useful_life <= 0 or elapsed_units <= 0:
-        return Decimal("0.00")
-
-    
-    annual_rate = Decimal("1") - (residual / cost) ** (Decimal("1") / Decimal(str(useful_life)))
-
-    
+def get_periodic_rate(annual_rate, computation):
     period = computation.upper()
     if period == "MONTH":
-        rate = annual_rate / Decimal("12")
+        return annual_rate / Decimal("12")
     elif period == "DAY":
-        rate = annual_rate / Decimal("365")
-    else:
-        rate = annual_rate
+        return annual_rate / Decimal("365")
+    return annual_rate
+
 
+def _floored(nbv, residual, floor_on_equal):
+    return nbv < residual or (floor_on_equal and nbv == residual)
+
+
+def _declining_nbv_loop(cost, residual, rate, elapsed_units, floor_on_equal=False):
     nbv = cost
     for _ in range(int(elapsed_units)):
         depreciation = nbv * rate
         nbv -= depreciation
-        if nbv < residual:
-            nbv = residual
-            break
+        if _floored(nbv, residual, floor_on_equal):
+            return residual
+    return nbv
+
+
+def declining_nbv(cost, residual, rate, elapsed_units, floor_on_equal=False):
+    # Closed form of the per-unit loop `nbv -= nbv * rate`, stopping at the
+    # residual floor: cost * (1 - rate) ** n, clamped to residual.
+    units = int(elapsed_units)
+    if units <= 0:
+        return cost
+
+    factor = Decimal("1") - rate
+    if _floored(cost - cost * rate, residual, floor_on_equal):
+        return residual
+
+    if factor < 0:
+        # NBV changes sign every unit, so there is no single crossover point.
+        return _declining_nbv_loop(cost, residual, rate, units, floor_on_equal)
+
+    nbv = cost * factor ** units
+    if _floored(nbv, residual, floor_on_equal):
+        return residual
+    return nbv
+
 
+def prorated_declining_nbv(cost, residual, rate, elapsed_units, first_weight):
+    # Declining balance under a convention: the acquisition period is charged
+    # first_weight of a full period, later periods in full, and a trailing
+    # partial period whatever is left of elapsed_units. Works on Decimal and
+    # float alike.
+    if elapsed_units <= 0:
+        return cost
+
+    first = min(elapsed_units, first_weight)
+    rest = elapsed_units - first
+    whole = int(rest)
+    nbv = cost * (1 - rate * first)
+    if whole:
+        # Skipped at zero: a rate of 1 would make it 0 ** 0, which Decimal rejects.
+        nbv *= (1 - rate) ** whole
+    nbv *= 1 - rate * (rest - whole)
+    if rate > 1 or nbv < residual:
+        return residual
+    return nbv
+
+
+def _near_half_cent(amount, cost, units):
+    # The loop and the closed form differ by a few units in the last of 28
+    # digits per step; only a value that close to a half cent can round apart.
+    cents = amount.scaleb(2)
+    distance = abs(cents - cents.to_integral_value(rounding=ROUND_FLOOR) - Decimal("0.5"))
+    return distance.scaleb(-2) <= abs(cost).scaleb(-24) * (units + 1)
+
+
+def declining_accumulated(cost, residual, rate, elapsed_units, floor_on_equal=False, first_weight=None):
+    if first_weight is not None:
+        nbv = prorated_declining_nbv(cost, residual, rate, Decimal(str(elapsed_units)), Decimal(str(first_weight)))
+        return (cost - nbv).quantize(Decimal("0.01"))
+
+    nbv = declining_nbv(cost, residual, rate, elapsed_units, floor_on_equal)
     accumulated = cost - nbv
+    if nbv != residual and _near_half_cent(accumulated, cost, int(elapsed_units)):
+        nbv = _declining_nbv_loop(cost, residual, rate, elapsed_units, floor_on_equal)
+        accumulated = cost - nbv
     return accumulated.quantize(Decimal("0.01"))
 
 
-def double_declining(total_amount, residual_value, useful_life, elapsed_units, computation):
+def reducing_balance(total_amount, residual_value, useful_life, elapsed_units, computation, first_weight=None):
+    cost = Decimal(str(total_amount))
+    residual = Decimal(str(residual_value))
+
+    if useful_life <= 0 or elapsed_units <= 0:
+        return Decimal("0.00")
+
+    
+    annual_rate = Decimal("1") - (residual / cost) ** (Decimal("1") / Decimal(str(useful_life)))
+    rate = get_periodic_rate(annual_rate, computation)
+
+    return declining_accumulated(cost, residual, rate, elapsed_units, first_weight=first_weight)
+
+
+def double_declining(total_amount, residual_value, useful_life, elapsed_units, computation, first_weight=None):
     cost = Decimal(str(total_amount))
     residual = Decimal(str(residual_value))
 
     
     annual_rate = Decimal("2") / Decimal(str(useful_life))
+    rate = get_periodic_rate(annual_rate, computation)
 
-    
-    period = computation.upper()
-    if period == "MONTH":
-        rate = annual_rate / Decimal("12")
-    elif period == "DAY":
-        rate = annual_rate / Decimal("365")
+    return declining_accumulated(cost, residual, rate, elapsed_units, first_weight=first_weight)
+
+
+# Float backend, for previews, forecasts and dashboards. Posting stays on the
+# Decimal functions above. Float results are rounded to the cent like the
+# Decimal ones and differ from them by at most FLOAT_MAX_DIVERGENCE (one cent):
+# each unit of a declining balance adds a few ulps of error, and whenever
+# FLOAT_ERROR_LIMIT could be exceeded the Decimal function is used instead, so
+# the two only disagree when the exact value sits within that much of a
+# half cent.
+DECIMAL_BACKEND = 'decimal'
+FLOAT_BACKEND = 'float'
+FLOAT_MAX_DIVERGENCE = Decimal("0.01")
+FLOAT_ERROR_LIMIT = 0.004
+
+UNITS_PER_YEAR = {'YEAR': 1, 'MONTH': 12, 'DAY': 365}
+
+
+def float_error_bound(cost, elapsed_units):
+    return abs(cost) * (elapsed_units + 4) * 2.0 ** -49
+
+
+def straight_line_float(total_amount, residual_value, total_units, elapsed_units):
+    if total_units == 0:
+        return 0.0
+
+    depreciable = float(total_amount) - float(residual_value)
+    return round(depreciable / total_units * elapsed_units, 2)
+
+
+def _declining_accumulated_float(cost, residual, rate, elapsed_units, first_weight=None):
+    if first_weight is not None:
+        return round(cost - prorated_declining_nbv(cost, residual, rate, elapsed_units, first_weight), 2)
+
+    units = int(elapsed_units)
+    if units <= 0:
+        return 0.0
+
+    factor = 1.0 - rate
+    if cost * factor < residual:
+        return round(cost - residual, 2)
+    nbv = cost * factor ** units
+    if nbv < residual:
+        nbv = residual
+    return round(cost - nbv, 2)
+
+
+def reducing_balance_float(total_amount, residual_value, useful_life, elapsed_units, computation,
+                           first_weight=None):
+    cost = float(total_amount)
+    residual = float(residual_value)
+
+    if useful_life <= 0 or elapsed_units <= 0:
+        return 0.0
+    if float_error_bound(cost, elapsed_units) > FLOAT_ERROR_LIMIT:
+        return float(reducing_balance(
+            total_amount, residual_value, useful_life, elapsed_units, computation, first_weight
+        ))
+
+    annual_rate = 1.0 - (residual / cost) ** (1.0 / useful_life)
+    rate = annual_rate / UNITS_PER_YEAR.get(computation.upper(), 1)
+    return _declining_accumulated_float(cost, residual, rate, elapsed_units, first_weight)
+
+
+def double_declining_float(total_amount, residual_value, useful_life, elapsed_units, computation,
+                           first_weight=None):
+    cost = float(total_amount)
+    residual = float(residual_value)
+
+    if float_error_bound(cost, elapsed_units) > FLOAT_ERROR_LIMIT:
+        return float(double_declining(
+            total_amount, residual_value, useful_life, elapsed_units, computation, first_weight
+        ))
+
+    annual_rate = 2.0 / useful_life
+    rate = annual_rate / UNITS_PER_YEAR.get(computation.upper(), 1)
+    return _declining_accumulated_float(cost, residual, rate, elapsed_units, first_weight)
+
+
+def incremental_depreciation(method, total_amount, residual_value, useful_life, period, computation,
+                             capitalization_date, seed_date, seed_nbv, seed_accumulated, as_of=None,
+                             convention=None):
+    # Carry a posted NBV forward: only the units between the seed posting and
+    # today are depreciated, starting from the posted figures.
+    cost = Decimal(str(total_amount))
+    residual = Decimal(str(residual_value))
+    seed_nbv = Decimal(str(seed_nbv))
+    seed_accumulated = Decimal(str(seed_accumulated))
+
+    total_units = get_total_units(useful_life, period, computation)
+    if convention is None:
+        seed_units = min(get_elapsed_units(capitalization_date, computation, as_of=seed_date), total_units)
+        elapsed_units = min(get_elapsed_units(capitalization_date, computation, as_of=as_of), total_units)
     else:
-        rate = annual_rate
+        seed_units, first_weight = prorated_units(convention, capitalization_date, computation, total_units, seed_date)
+        elapsed_units, first_weight = prorated_units(convention, capitalization_date, computation, total_units, as_of)
+    new_units = max(elapsed_units - seed_units, 0)
 
-    nbv = cost
-    for _ in range(int(elapsed_units)):
-        depreciation = nbv * rate
-        nbv -= depreciation
-        if nbv < residual:
-            nbv = residual
-            break
+    if new_units == 0 or seed_nbv <= residual:
+        nbv = seed_nbv
+    elif method == 'Straight Line':
+        per_unit = (cost - residual) / total_units
+        nbv = max(seed_nbv - per_unit * new_units, residual)
+    else:
+        if method == 'Double Declining':
+            annual_rate = Decimal("2") / Decimal(str(useful_life))
+        else:
+            annual_rate = Decimal("1") - (residual / cost) ** (Decimal("1") / Decimal(str(useful_life)))
+        rate = get_periodic_rate(annual_rate, computation)
+        if convention is None:
+            nbv = declining_nbv(seed_nbv, residual, rate, new_units)
+        else:
+            # Scale the posted NBV by the convention-weighted decline between
+            # the two dates; the residual floor applies to the result only.
+            seed_decline = prorated_declining_nbv(Decimal("1"), Decimal("0"), rate, seed_units, first_weight)
+            if seed_decline <= 0:
+                nbv = residual
+            else:
+                decline = prorated_declining_nbv(Decimal("1"), Decimal("0"), rate, elapsed_units, first_weight)
+                nbv = max(seed_nbv * decline / seed_decline, residual)
 
-    accumulated = cost - nbv
-    return accumulated.quantize(Decimal("0.01"))
+    accumulated = seed_accumulated + (seed_nbv - nbv)
+    return accumulated.quantize(Decimal("0.01")), nbv.quantize(Decimal("0.01"))
+
+
+def calculate_depreciation(method, total_amount, residual_value, useful_life, period, computation,
+                           capitalization_date, as_of=None, backend=DECIMAL_BACKEND, convention=None):
+    total_units = get_total_units(useful_life, period, computation)
+    if convention is None:
+        elapsed_units = get_elapsed_units(capitalization_date, computation, as_of=as_of)
+        elapsed_units = min(elapsed_units, total_units)
+        first_weight = None
+    else:
+        elapsed_units, first_weight = prorated_units(
+            convention, capitalization_date, computation, total_units, as_of
+        )
+
+    if backend == FLOAT_BACKEND:
+        total_amount = float(total_amount)
+        residual_value = float(residual_value)
+        if convention is not None:
+            elapsed_units, first_weight = float(elapsed_units), float(first_weight)
+        if method == "Straight Line":
+            accumulated = straight_line_float(total_amount, residual_value, total_units, elapsed_units)
+        elif method == "Reducing Balance":
+            accumulated = reducing_balance_float(
+                total_amount, residual_value, useful_life, elapsed_units, computation, first_weight
+            )
+        else:
+            accumulated = double_declining_float(
+                total_amount, residual_value, useful_life, elapsed_units, computation, first_weight
+            )
+    elif method == "Straight Line":
+        accumulated = straight_line(total_amount, residual_value, total_units, elapsed_units)
+    elif method == "Reducing Balance":
+        accumulated = reducing_balance(
+            total_amount, residual_value, useful_life, elapsed_units, computation.upper(), first_weight
+        )
+    else:
+        accumulated = double_declining(
+            total_amount, residual_value, useful_life, elapsed_units, computation.upper(), first_weight
+        )
+    if convention is not None:
+        elapsed_units = float(elapsed_units)
+
+    current_nbv = max(total_amount - accumulated, residual_value)
+
+    return {
+        "depreciation_method": method,
+        "total_units": total_units,
+        "elapsed_units": elapsed_units,
+        "accumulated_depreciation": round(accumulated, 2),
+        "current_nbv": round(current_nbv, 2),
+    }
+
+
+@lru_cache(maxsize=DEPRECIATION_CACHE_SIZE)
+def _cached_depreciation(method, total_amount, residual_value, useful_life, period, computation,
+                         capitalization_date, as_of, backend, convention):
+    return calculate_depreciation(
+        method, total_amount, residual_value, useful_life, period, computation, capitalization_date,
+        as_of, backend, convention
+    )
+
+
+def cached_depreciation(method, total_amount, residual_value, useful_life, period, computation,
+                        capitalization_date, as_of=None, backend=DECIMAL_BACKEND, convention=None):
+    # Results only depend on the arguments once as_of is pinned, so identical
+    # requests on the same day are answered from an LRU cache.
+    as_of = as_of or date.today()
+    if isinstance(as_of, datetime):
+        as_of = as_of.date()
+    return dict(_cached_depreciation(
+        method, total_amount, residual_value, useful_life, period, computation, capitalization_date,
+        as_of, backend, convention
+    ))
+
+
+def get_total_units_array(useful_life, period, computation):
+    useful_life = np.asarray(useful_life, dtype=np.int64)
+    period = np.char.upper(np.asarray(period, dtype=str))
+    computation = np.char.upper(np.asarray(computation, dtype=str))
+
+    total_days = np.select(
+        [period == 'YEAR', period == 'MONTH'],
+        [useful_life * 365, useful_life * 30],
+        default=useful_life,
+    )
+    converted = np.select(
+        [computation == 'YEAR', computation == 'MONTH'],
+        [total_days // 365, total_days // 30],
+        default=total_days,
+    )
+    total_units = np.where(period == computation, useful_life, converted)
+    return np.where(useful_life <= 0, 0, total_units)
+
+
+def _elapsed_units_between(start, today, computation):
+    start_years, start_months, start_days = _date_parts(start)
+    today_years, today_months, today_days = _date_parts(today)
+
+    # Same as relativedelta: a month only counts once the anniversary day,
+    # clipped to the length of the current month, has been reached.
+    months = (today_years - start_years) * 12 + (today_months - start_months)
+    anniversary = np.minimum(start_days, _days_in_month(today_years, today_months))
+    months = months - (anniversary > today_days)
+
+    elapsed = np.select(
+        [computation == 'YEAR', computation == 'MONTH'],
+        [months // 12, months],
+        default=(today - start).astype(np.int64),
+    )
+    return np.where(np.isnat(start) | (start >= today), 0, elapsed)
+
+
+def get_elapsed_units_array(capitalization_date, computation, as_of=None):
+    start = _as_date_array(capitalization_date)
+    computation = np.char.upper(np.asarray(computation, dtype=str))
+    today = as_of or date.today()
+    if isinstance(today, datetime):
+        today = today.date()
+    today = np.full(start.shape, np.datetime64(today, 'D'))
+    return _elapsed_units_between(start, today, computation)
+
+
+def _portfolio_accumulated(method, cost, residual, useful_life, computation, total_units, elapsed_units,
+                           first_weight=None):
+    # Arrays broadcast against each other, so elapsed_units may carry an extra
+    # leading axis of dates (see portfolio_forecast). first_weight is the
+    # convention weight of each asset's acquisition period, if any.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        straight = np.where(
+            total_units == 0, 0.0,
+            (cost - residual) / total_units * elapsed_units,
+        )
+
+        life = np.where(useful_life > 0, useful_life, 1).astype(np.float64)
+        units_per_year = np.select(
+            [computation == 'MONTH', computation == 'DAY'], [12.0, 365.0], default=1.0
+        )
+        reducing_rate = (1.0 - (residual / cost) ** (1.0 / life)) / units_per_year
+        double_rate = (2.0 / life) / units_per_year
+        rate = np.where(method == 'Double Declining', double_rate, reducing_rate)
+
+        factor = 1.0 - rate
+        if first_weight is None:
+            declining_nbv = cost * factor ** elapsed_units
+            floored = (cost * factor < residual) | (declining_nbv < residual)
+        else:
+            first = np.minimum(elapsed_units, first_weight)
+            rest = elapsed_units - first
+            whole = np.floor(rest)
+            declining_nbv = cost * (1.0 - rate * first) * factor ** whole * (1.0 - rate * (rest - whole))
+            floored = (rate > 1.0) | (declining_nbv < residual)
+        declining_nbv = np.where(floored, residual, declining_nbv)
+        declining_nbv = np.where(elapsed_units <= 0, cost, declining_nbv)
+        declining = np.where(total_units == 0, 0.0, cost - declining_nbv)
+
+    accumulated = np.where(method == 'Straight Line', straight, declining)
+    accumulated = np.where(useful_life <= 0, 0.0, accumulated)
+    accumulated = np.round(np.nan_to_num(accumulated), 2)
+
+    inexact = (
+        (method != 'Straight Line') & (total_units > 0) & (cost > residual)
+        & (float_error_bound(cost, elapsed_units) > FLOAT_ERROR_LIMIT)
+    )
+    if inexact.any():
+        weights = np.full(np.shape(cost), np.nan) if first_weight is None else first_weight
+        method, cost, residual, useful_life, computation, elapsed_units, weights = np.broadcast_arrays(
+            method, cost, residual, useful_life, computation, elapsed_units, weights
+        )
+        for index in zip(*np.nonzero(inexact)):
+            if method[index] == 'Double Declining':
+                exact = double_declining
+            else:
+                exact = reducing_balance
+            if first_weight is None:
+                units, weight = int(elapsed_units[index]), None
+            else:
+                units, weight = float(elapsed_units[index]), float(weights[index])
+            accumulated[index] = float(exact(
+                cost[index], residual[index], int(useful_life[index]), units, computation[index], weight
+            ))
+    return accumulated
+
+
+def _portfolio_nbv(cost, residual, accumulated):
+    nbv = np.round(np.maximum(cost - accumulated, residual), 2)
+    return np.where(cost <= residual, np.round(residual, 2), nbv)
+
+
+def portfolio_depreciation(method, total_amount, residual_value, useful_life,
+                           period, computation, capitalization_date, as_of=None, convention=None):
+    # Vectorized counterpart of FixedAssetRegister.calculate_current_nbv for a
+    # whole register on the float backend, with the same one-cent bound.
+    method = np.asarray(method, dtype=str)
+    cost = np.asarray(total_amount, dtype=np.float64)
+    residual = np.asarray(residual_value, dtype=np.float64)
+    useful_life = np.asarray(useful_life, dtype=np.int64)
+    computation = np.char.upper(np.asarray(computation, dtype=str))
+
+    total_units = get_total_units_array(useful_life, period, computation)
+    if convention is None:
+        elapsed_units = np.minimum(get_elapsed_units_array(capitalization_date, computation, as_of), total_units)
+        first_weight = None
+    else:
+        elapsed_units, first_weight = prorated_units_array(
+            convention, capitalization_date, computation, total_units, as_of
+        )
+
+    accumulated = _portfolio_accumulated(
+        method, cost, residual, useful_life, computation, total_units, elapsed_units, first_weight
+    )
+    return accumulated, _portfolio_nbv(cost, residual, accumulated)
+
+
+FORECAST_FREQUENCIES = {'MONTH': 'months', 'YEAR': 'years'}
+
+
+def get_forecast_period_ends(start, periods, frequency='MONTH'):
+    if isinstance(start, datetime):
+        start = start.date()
+    step = FORECAST_FREQUENCIES[frequency.upper()]
+    return [start + relativedelta(**{step: index}) for index in range(1, periods + 1)]
+
+
+def portfolio_forecast(method, total_amount, residual_value, useful_life, period, computation,
+                       capitalization_date, period_ends, start=None, convention=None):
+    # Projects every asset across every period end in one pass. Returns
+    # (accumulated, charge, nbv), each shaped (len(period_ends), assets); the
+    # first charge is measured from start, or today when start is not given.
+    method = np.asarray(method, dtype=str)
+    cost = np.asarray(total_amount, dtype=np.float64)
+    residual = np.asarray(residual_value, dtype=np.float64)
+    useful_life = np.asarray(useful_life, dtype=np.int64)
+    computation = np.char.upper(np.asarray(computation, dtype=str))
+
+    total_units = get_total_units_array(useful_life, period, computation)
+    begin = _as_date_array(capitalization_date)
+    dates = _as_date_array([start or date.today()] + list(period_ends))[:, np.newaxis]
+    if convention is None:
+        elapsed_units = np.minimum(
+            _elapsed_units_between(begin, np.broadcast_to(dates, (len(dates), len(begin))), computation),
+            total_units,
+        )
+        first_weight = None
+    else:
+        elapsed_units, first_weight = prorated_units_array(
+            convention, capitalization_date, computation, total_units, dates
+        )
+
+    accumulated = _portfolio_accumulated(
+        method, cost, residual, useful_life, computation, total_units, elapsed_units, first_weight
+    )
+    charge = np.round(np.diff(accumulated, axis=0), 2)
+    accumulated = accumulated[1:]
+    return accumulated, charge, _portfolio_nbv(cost, residual, accumulated)
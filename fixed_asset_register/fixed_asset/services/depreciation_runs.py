@@ -0,0 +1,441 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+import csv
+import json
+import os
+
+from django.db import connection, connections, models, transaction
+
+from ..models import (
+    Account,
+    AssetPolicy,
+    Depreciation,
+    DepreciationAuditLog,
+    DepreciationEvent,
+    FixedAssetRegister,
+    Users,
+    get_default_convention,
+)
+
+
+DEPRECIATION_RUN_FIELDS = [
+    'register_id', 'fixed_asset_code', 'fixed_asset_account', 'asset_status',
+    'depreciation_method', 'total_amount', 'residual_value', 'useful_life',
+    'period', 'computation', 'capitalization_date', 'current_nbv',
+]
+
+
+def _new_run_report():
+    return {
+        'processed': 0,
+        'finished': 0,
+        'skipped': [],
+        'total_depreciation': 0.0,
+    }
+
+
+def _merge_run_report(report, chunk_report):
+    report['processed'] += chunk_report['processed']
+    report['finished'] += chunk_report['finished']
+    report['skipped'].extend(chunk_report['skipped'])
+    report['total_depreciation'] = round(
+        report['total_depreciation'] + chunk_report['total_depreciation'], 2
+    )
+    return report
+
+
+def _accounts_by_name(names):
+    accounts = {}
+    for account in Account.objects.filter(account_name__in=names).order_by('account_id'):
+        accounts.setdefault(account.account_name, account)
+
+    for name in names:
+        if name not in accounts:
+            accounts[name] = Account.objects.create(account_name=name, account_type='Asset')
+    return accounts
+
+
+def _policies_by_register(register_ids):
+    policies = {}
+    for policy in AssetPolicy.objects.filter(register_id__in=register_ids).order_by('policy_id'):
+        policies.setdefault(policy.register_id, policy)
+    return policies
+
+
+def _bulk_create_depreciations(depreciations, depreciation_date):
+    Depreciation.objects.bulk_create(depreciations)
+    if connection.features.can_return_rows_from_bulk_insert:
+        return
+
+    # MySQL does not hand back auto-increment keys from a bulk insert; the rows
+    # just written in this transaction are the newest ones for each register.
+    register_ids = [depreciation.register_id for depreciation in depreciations]
+    latest = dict(
+        Depreciation.objects
+        .filter(register_id__in=register_ids, depreciation_date=depreciation_date)
+        .values('register_id')
+        .annotate(latest_id=models.Max('depreciation_id'))
+        .values_list('register_id', 'latest_id')
+    )
+    for depreciation in depreciations:
+        depreciation.depreciation_id = latest[depreciation.register_id]
+
+
+def _latest_events_by_register(register_ids):
+    # Same ordering as get_last_depreciation_event, so a back-dated event
+    # posted after a later one does not become the latest.
+    latest_id = (
+        DepreciationEvent.objects
+        .filter(register_id=models.OuterRef('register_id'))
+        .order_by('-depreciation_date', '-event_id')
+        .values('event_id')[:1]
+    )
+    return {
+        event.register_id: event
+        for event in DepreciationEvent.objects.filter(
+            register_id__in=register_ids, event_id=models.Subquery(latest_id)
+        ).only(
+            'event_id', 'register_id', 'depreciation_date', 'nbv_depreciation', 'accumulated_depreciation'
+        )
+    }
+
+
+def _depreciation_results(assets, depreciation_date, incremental=False, convention=None):
+    # What a run would post for these assets, shared by posting and the dry
+    # run: (policies, [(asset, old_nbv, new_nbv, amount)], skipped).
+    policies = _policies_by_register([asset.register_id for asset in assets])
+    postable = []
+    skipped = []
+    for asset in assets:
+        if asset.register_id not in policies:
+            skipped.append({'register_id': asset.register_id, 'reason': 'No asset policy'})
+            continue
+        postable.append(asset)
+
+    # The opening NBV is the one last posted, not current_nbv, which a refresh
+    # or an adjustment may have moved past it since.
+    last_events = _latest_events_by_register([asset.register_id for asset in postable]) if postable else {}
+
+    results = []
+    for asset in postable:
+        last_event = last_events.get(asset.register_id)
+        if last_event is not None and last_event.depreciation_date >= depreciation_date:
+            # Already posted through this date: a rerun posts nothing new.
+            skipped.append({'register_id': asset.register_id, 'reason': 'Already posted'})
+            continue
+        old_nbv = last_event.nbv_depreciation if last_event is not None else asset.total_amount
+        if incremental:
+            new_nbv = asset.calculate_incremental_nbv(last_event, depreciation_date, convention)
+        else:
+            new_nbv = asset.calculate_current_nbv(depreciation_date, convention)
+        results.append((asset, old_nbv, new_nbv, round(old_nbv - new_nbv, 2)))
+    return policies, results, skipped
+
+
+def _post_depreciation_chunk(assets, user, depreciation_date, show_in_journal=False, incremental=False,
+                             convention=None):
+    report = _new_run_report()
+
+    policies, results, report['skipped'] = _depreciation_results(
+        assets, depreciation_date, incremental, convention
+    )
+    if not results:
+        return report
+    postable = [asset for asset, _, _, _ in results]
+
+    accounts = _accounts_by_name({asset.fixed_asset_account for asset in postable})
+
+    depreciations = []
+    for asset, old_nbv, new_nbv, depreciation_amount in results:
+        depreciations.append(Depreciation(
+            register=asset,
+            account=accounts[asset.fixed_asset_account],
+            depreciation_date=depreciation_date,
+            method=asset.depreciation_method,
+            computation=asset.computation,
+            book_value=new_nbv,
+            journal='Depreciation Journal Entry' if show_in_journal else '',
+            depreciation_rate=0.0,
+        ))
+
+    _bulk_create_depreciations(depreciations, depreciation_date)
+
+    events = []
+    audit_logs = []
+    for (asset, old_nbv, new_nbv, depreciation_amount), depreciation in zip(results, depreciations):
+        old_accumulated = round(asset.total_amount - old_nbv, 2)
+        new_accumulated = round(asset.total_amount - new_nbv, 2)
+
+        events.append(DepreciationEvent(
+            register=asset,
+            policy=policies[asset.register_id],
+            depreciation=depreciation,
+            depreciation_date=depreciation_date,
+            depreciation_amount=depreciation_amount,
+            accumulated_depreciation=new_accumulated,
+            nbv_depreciation=new_nbv,
+        ))
+        audit_logs.append(DepreciationAuditLog(
+            register=asset,
+            depreciation=depreciation,
+            action_type='CREATE',
+            depreciation_date=depreciation_date,
+            old_book_value=old_nbv,
+            new_book_value=new_nbv,
+            old_accumulated=old_accumulated,
+            new_accumulated=new_accumulated,
+            performed_by=user,
+            remark=f'Period-end depreciation for {asset.fixed_asset_code}',
+        ))
+
+        asset.current_nbv = new_nbv
+        if asset.current_nbv <= asset.residual_value:
+            asset.asset_status = 'Finished'
+            report['finished'] += 1
+
+        report['processed'] += 1
+        report['total_depreciation'] = round(report['total_depreciation'] + depreciation_amount, 2)
+
+    DepreciationEvent.objects.bulk_create(events)
+    DepreciationAuditLog.objects.bulk_create(audit_logs)
+    FixedAssetRegister.objects.bulk_update(postable, ['current_nbv', 'asset_status'])
+
+    return report
+
+
+def run_depreciation(register_id, user_id, depreciation_date=None, show_in_journal=False, incremental=False):
+    register = FixedAssetRegister.objects.only(*DEPRECIATION_RUN_FIELDS).get(pk=register_id)
+    user = Users.objects.get(pk=user_id) if user_id else None
+
+    with transaction.atomic():
+        return _post_depreciation_chunk(
+            [register], user, depreciation_date or date.today(), show_in_journal, incremental,
+            get_default_convention()
+        )
+
+
+def run_period_depreciation(user_id=None, depreciation_date=None, chunk_size=500, show_in_journal=False, queryset=None,
+                            incremental=False):
+    user = Users.objects.get(pk=user_id) if user_id else None
+    depreciation_date = depreciation_date or date.today()
+
+    if queryset is None:
+        queryset = FixedAssetRegister.objects.all()
+    queryset = queryset.filter(asset_status='Ready to Use').only(*DEPRECIATION_RUN_FIELDS).order_by('register_id')
+
+    convention = get_default_convention()
+    report = _new_run_report()
+    report['chunks'] = 0
+    last_id = 0
+    while True:
+        assets = list(queryset.filter(register_id__gt=last_id)[:chunk_size])
+        if not assets:
+            break
+        last_id = assets[-1].register_id
+
+        with transaction.atomic():
+            chunk_report = _post_depreciation_chunk(
+                assets, user, depreciation_date, show_in_journal, incremental, convention
+            )
+
+        _merge_run_report(report, chunk_report)
+        report['chunks'] += 1
+
+    return report
+
+
+NBV_REFRESH_FIELDS = [
+    'register_id', 'asset_status', 'depreciation_method', 'total_amount', 'residual_value',
+    'useful_life', 'period', 'computation', 'capitalization_date', 'current_nbv',
+]
+
+
+def refresh_current_nbv(as_of=None, chunk_size=2000, start_after=0):
+    # Streams the register in keyset pages (bounded memory on every backend,
+    # including MySQL where iterator() cannot use a server-side cursor) and
+    # writes only the rows whose stored NBV drifted. Yields
+    # (last register_id, scanned, updated) after each page so callers can
+    # checkpoint.
+    as_of = as_of or date.today()
+    convention = get_default_convention()
+    queryset = (
+        FixedAssetRegister.objects.exclude(asset_status='Disposal')
+        .only(*NBV_REFRESH_FIELDS).order_by('register_id')
+    )
+
+    last_id = start_after
+    scanned = updated = 0
+    while True:
+        changed = []
+        page = 0
+        for asset in queryset.filter(register_id__gt=last_id)[:chunk_size].iterator(chunk_size=chunk_size):
+            page += 1
+            last_id = asset.register_id
+            nbv = asset.calculate_current_nbv(as_of, convention)
+            if nbv != asset.current_nbv:
+                asset.current_nbv = nbv
+                changed.append(asset)
+        if not page:
+            return
+
+        if changed:
+            FixedAssetRegister.objects.bulk_update(changed, ['current_nbv'], batch_size=chunk_size)
+        scanned += page
+        updated += len(changed)
+        yield last_id, scanned, updated
+
+
+DEPRECIATION_PREVIEW_COLUMNS = [
+    'register_id', 'fixed_asset_code', 'account', 'policy_id', 'depreciation_date', 'method', 'computation',
+    'old_nbv', 'new_nbv', 'nbv_delta', 'depreciation_amount', 'old_accumulated', 'new_accumulated',
+    'old_status', 'new_status', 'skipped_reason',
+]
+
+
+def preview_period_depreciation(depreciation_date=None, chunk_size=500, queryset=None, incremental=False):
+    # Dry run of run_period_depreciation: yields, in register order, the
+    # Depreciation/DepreciationEvent figures each asset would get. Pages are
+    # read in autocommit, so nothing is written and no transaction stays open.
+    depreciation_date = depreciation_date or date.today()
+    convention = get_default_convention()
+
+    if queryset is None:
+        queryset = FixedAssetRegister.objects.all()
+    queryset = queryset.filter(asset_status='Ready to Use').only(*DEPRECIATION_RUN_FIELDS).order_by('register_id')
+
+    last_id = 0
+    while True:
+        assets = list(queryset.filter(register_id__gt=last_id)[:chunk_size])
+        if not assets:
+            return
+        last_id = assets[-1].register_id
+
+        policies, results, skipped = _depreciation_results(assets, depreciation_date, incremental, convention)
+        results = {asset.register_id: result for asset, *result in results}
+        skipped = {item['register_id']: item['reason'] for item in skipped}
+
+        for asset in assets:
+            row = {
+                'register_id': asset.register_id,
+                'fixed_asset_code': asset.fixed_asset_code,
+                'account': asset.fixed_asset_account,
+                'depreciation_date': depreciation_date.isoformat(),
+                'method': asset.depreciation_method,
+                'computation': asset.computation,
+                'old_nbv': asset.current_nbv,
+                'old_status': asset.asset_status,
+            }
+            if asset.register_id in skipped:
+                row['skipped_reason'] = skipped[asset.register_id]
+                yield row
+                continue
+
+            old_nbv, new_nbv, depreciation_amount = results[asset.register_id]
+            row.update({
+                'policy_id': policies[asset.register_id].policy_id,
+                'old_nbv': old_nbv,
+                'new_nbv': new_nbv,
+                'nbv_delta': round(new_nbv - old_nbv, 2),
+                'depreciation_amount': depreciation_amount,
+                'old_accumulated': round(asset.total_amount - old_nbv, 2),
+                'new_accumulated': round(asset.total_amount - new_nbv, 2),
+                'new_status': 'Finished' if new_nbv <= asset.residual_value else asset.asset_status,
+            })
+            yield row
+
+
+class _EchoBuffer:
+    def write(self, value):
+        return value
+
+
+def stream_depreciation_preview(rows, output_format='ndjson'):
+    # Encodes preview rows one line at a time for streaming responses.
+    if output_format == 'csv':
+        writer = csv.writer(_EchoBuffer())
+        yield writer.writerow(DEPRECIATION_PREVIEW_COLUMNS)
+        for row in rows:
+            yield writer.writerow([row.get(column, '') for column in DEPRECIATION_PREVIEW_COLUMNS])
+    else:
+        for row in rows:
+            yield json.dumps(row, default=str) + '\n'
+
+
+def _init_depreciation_worker():
+    import django
+    django.setup()
+    # Never reuse a connection inherited from the parent process.
+    connections.close_all()
+
+
+def _run_depreciation_partition(partition, user_id, depreciation_date, chunk_size, show_in_journal, incremental):
+    try:
+        return run_period_depreciation(
+            user_id=user_id,
+            depreciation_date=depreciation_date,
+            chunk_size=chunk_size,
+            show_in_journal=show_in_journal,
+            queryset=FixedAssetRegister.objects.filter(**partition),
+            incremental=incremental,
+        )
+    finally:
+        connections.close_all()
+
+
+def get_depreciation_partitions(partition_by='account', partitions=None):
+    queryset = FixedAssetRegister.objects.filter(asset_status='Ready to Use')
+
+    if partition_by == 'account':
+        account_ids = queryset.order_by('account_id').values_list('account_id', flat=True).distinct()
+        return [{'account_id': account_id} for account_id in account_ids]
+
+    if partition_by == 'range':
+        register_ids = list(queryset.order_by('register_id').values_list('register_id', flat=True))
+        if not register_ids:
+            return []
+        partitions = max(1, min(partitions or os.cpu_count() or 1, len(register_ids)))
+        size = -(-len(register_ids) // partitions)
+        return [
+            {
+                'register_id__gte': register_ids[start],
+                'register_id__lte': register_ids[min(start + size, len(register_ids)) - 1],
+            }
+            for start in range(0, len(register_ids), size)
+        ]
+
+    raise ValueError(f'Unknown partition_by: {partition_by}')
+
+
+def run_parallel_depreciation(user_id=None, depreciation_date=None, partition_by='account', workers=None,
+                              chunk_size=500, show_in_journal=False, incremental=False):
+    workers = workers or os.cpu_count() or 1
+    depreciation_date = depreciation_date or date.today()
+    partitions = get_depreciation_partitions(partition_by, workers)
+
+    report = _new_run_report()
+    report['chunks'] = 0
+    report['partitions'] = len(partitions)
+    report['failed_partitions'] = []
+    if not partitions:
+        return report
+
+    # Workers must open their own connections, so the parent's can't be shared.
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_depreciation_worker) as executor:
+        futures = {
+            executor.submit(
+                _run_depreciation_partition,
+                partition, user_id, depreciation_date, chunk_size, show_in_journal, incremental
+            ): partition
+            for partition in partitions
+        }
+        for future in as_completed(futures):
+            try:
+                partition_report = future.result()
+            except Exception as e:
+                report['failed_partitions'].append({'partition': futures[future], 'error': str(e)})
+                continue
+            _merge_run_report(report, partition_report)
+            report['chunks'] += partition_report['chunks']
+
+    return report
@@ -0,0 +1,312 @@
+from decimal import Decimal
+from dateutil.relativedelta import relativedelta
+from functools import lru_cache
+import numpy as np
+
+
+def annuity_present_value(payment, rate, first, last, advance=False):
+    # Closed form of sum(payment / (1 + rate) ** t for t in first..last); in
+    # advance each payment falls one period earlier (t - 1).
+    count = last - first + 1
+    if count <= 0:
+        return Decimal('0')
+    if not rate:
+        return payment * count
+
+    growth = Decimal('1') + rate
+    exponent = first - 1 if advance else first
+    return payment * (Decimal('1') - growth ** -count) / rate / growth ** (exponent - 1)
+
+
+def first_changed_period(change_at_period, total_periods):
+    # First period paying changing_amount (total_periods + 1 when none does),
+    # matching the schedules' `change_at_period and t > change_at_period`.
+    if not change_at_period:
+        return total_periods + 1
+    return min(max(change_at_period, 0), total_periods) + 1
+
+
+def percent_factors(rate, years):
+    # Payment multiplier for each lease year at rate percent a year.
+    growth = Decimal('1') + Decimal(str(rate)) / 100
+    return tuple(growth ** year for year in range(years))
+
+
+def payment_runs(total_periods, payment, changing_amount, changed_from, factors=None, periods_per_year=12):
+    # A lease's payments as runs of equal amounts, ((first, last, amount), ...)
+    # over periods 1..total_periods: payment before changed_from,
+    # changing_amount from it, each scaled by its lease year's escalation
+    # factor and rounded to cents when escalated.
+    base = [(1, changed_from - 1, payment), (changed_from, total_periods, changing_amount)]
+    if factors is None:
+        return tuple(run for run in base if run[0] <= run[1])
+
+    runs = []
+    for year, factor in enumerate(factors):
+        year_first = year * periods_per_year + 1
+        year_last = min(year_first + periods_per_year - 1, total_periods)
+        for first, last, amount in base:
+            first, last = max(first, year_first), min(last, year_last)
+            if first > last:
+                continue
+            if factor != 1:
+                amount = (amount * factor).quantize(Decimal('0.01'))
+            if runs and runs[-1][2] == amount and runs[-1][1] == first - 1:
+                runs[-1] = (runs[-1][0], last, amount)
+            else:
+                runs.append((first, last, amount))
+    return tuple(runs)
+
+
+def expand_runs(runs, after=0):
+    # Per-period payments for the periods after `after`.
+    payments = []
+    for first, last, amount in runs:
+        first = max(first, after + 1)
+        if first <= last:
+            payments += [amount] * (last - first + 1)
+    return payments
+
+
+def runs_present_value(runs, rate, advance=False, after=0):
+    # Present value at the end of period `after` of the later payments, one
+    # closed-form annuity per run.
+    total = Decimal('0')
+    for first, last, amount in runs:
+        first = max(first, after + 1)
+        total += annuity_present_value(amount, rate, first - after, last - after, advance)
+    return total
+
+
+@lru_cache(maxsize=4096)
+def schedule_dates(start_date, step_months, periods):
+    # Dates of periods 1..periods, each the previous one plus step_months as
+    # the schedules have always stepped (a clipped month-end day stays
+    # clipped). Shared by every lease with the same start, frequency and term.
+    dates = []
+    current = start_date
+    step = relativedelta(months=step_months)
+    for _ in range(periods):
+        current = current + step
+        dates.append(current)
+    return tuple(dates)
+
+
+def round_columns(columns, non_negative=()):
+    # Amount columns rounded to cents, clamped at zero where the schedules
+    # show no negative balance; period and date columns pass through.
+    rounded = {}
+    for name, values in columns.items():
+        if name in ('period', 'date'):
+            rounded[name] = values
+        elif name in non_negative:
+            rounded[name] = [round(max(0, value), 2) for value in values]
+        else:
+            rounded[name] = [round(value, 2) for value in values]
+    return rounded
+
+
+def schedule_rows(columns):
+    # Serialization boundary: rounded columns to the row dicts the API returns.
+    names = list(columns)
+    rows = []
+    for values in zip(*columns.values()):
+        row = dict(zip(names, values))
+        row['date'] = row['date'].strftime('%Y-%m-%d')
+        rows.append(row)
+    return rows
+
+
+def amortization_columns(opening_balance, periodic_rate, payments, periods, dates, advance=False):
+    # Liability columns for consecutive periods: each period accrues interest
+    # on its opening balance and the payment settles interest first. Paid in
+    # advance, the payment comes off the opening balance before interest.
+    opening, interest, principal, closing = [], [], [], []
+    remaining_balance = opening_balance
+    for payment in payments:
+        interest_expense = (remaining_balance - payment if advance else remaining_balance) * periodic_rate
+        principal_reduction = payment - interest_expense
+
+        opening.append(remaining_balance)
+        remaining_balance -= principal_reduction
+        interest.append(interest_expense)
+        principal.append(principal_reduction)
+        closing.append(remaining_balance)
+
+    return {
+        "period": periods,
+        "date": dates,
+        "opening_balance": opening,
+        "payment": payments,
+        "interest": interest,
+        "principal": principal,
+        "closing_balance": closing,
+    }
+
+
+def rou_columns(opening_rou, periods, dates):
+    # Straight line over the given periods, the last one taking what is left.
+    count = len(periods)
+    periodic_depreciation = opening_rou / count if count > 0 else Decimal('0.00')
+
+    opening, depreciation, closing = [], [], []
+    remaining_rou = opening_rou
+    for t in range(1, count + 1):
+        charge = remaining_rou if t == count else periodic_depreciation
+        opening.append(remaining_rou)
+        depreciation.append(charge)
+        remaining_rou -= charge
+        closing.append(remaining_rou)
+
+    return {
+        "period": periods,
+        "date": dates,
+        "opening_rou": opening,
+        "depreciation": depreciation,
+        "closing_rou": closing,
+    }
+
+
+def lease_period_dates(start_dates, step_months, total_periods):
+    # (A, T) dates of periods 1..T. Like the schedules, each date is the
+    # previous one plus step_months, so a day clipped at a month end stays
+    # clipped. valid masks the periods within each lease's term.
+    start = np.asarray(start_dates, dtype='datetime64[D]')
+    total_periods = np.asarray(total_periods, dtype=np.int64)
+    width = int(total_periods.max(initial=0))
+
+    start_month = start.astype('datetime64[M]')
+    day = (start - start_month.astype('datetime64[D]')).astype(np.int64) + 1
+    months = (
+        start_month.astype(np.int64)[:, np.newaxis]
+        + np.asarray(step_months, dtype=np.int64)[:, np.newaxis] * np.arange(1, width + 1)
+    )
+    month_start = months.astype('datetime64[M]').astype('datetime64[D]')
+    days_in_month = ((months + 1).astype('datetime64[M]').astype('datetime64[D]') - month_start).astype(np.int64)
+    day = np.minimum.accumulate(np.minimum(day[:, np.newaxis], days_in_month), axis=1)
+
+    valid = np.arange(1, width + 1) <= total_periods[:, np.newaxis]
+    return month_start + (day - 1), valid
+
+
+def _annuity_accumulated(rate, growth, periods):
+    # sum of (1 + r) ** k for k in 0..n-1, n where the rate is zero.
+    return np.where(rate == 0, periods, (growth ** periods - 1) / np.where(rate == 0, 1, rate))
+
+
+def _advance_growth(growth, advance):
+    # In advance B_t = (B_{t-1} - P_t) (1 + r): the arrears recurrence with
+    # every payment grown by one period.
+    if advance is None:
+        return np.ones_like(growth)
+    return np.where(np.asarray(advance, dtype=bool)[:, np.newaxis], growth, 1.0)
+
+
+def amortization_balances(present_value, rate, payment, changing_amount, changed_from, width, advance=None):
+    # Closed form of get_amortization_schedule's B_t = B_{t-1} (1 + r) - P_t:
+    # (A, width + 1) balances after t = 0..width periods and (A, width)
+    # payments. advance flags the leases paid in advance.
+    present_value, rate, payment, changing_amount = (
+        np.asarray(values, dtype=np.float64)[:, np.newaxis]
+        for values in (present_value, rate, payment, changing_amount)
+    )
+    changed_from = np.asarray(changed_from, dtype=np.int64)[:, np.newaxis]
+    growth = 1 + rate
+    shift = _advance_growth(growth, advance)
+
+    t = np.arange(width + 1)
+    before = np.minimum(t, changed_from - 1)
+    after = t - before
+    balances = (
+        present_value * growth ** t
+        - shift * payment * _annuity_accumulated(rate, growth, before) * growth ** after
+        - shift * changing_amount * _annuity_accumulated(rate, growth, after)
+    )
+    payments = np.where(t[1:] >= changed_from, changing_amount, payment)
+    return balances, payments
+
+
+def escalated_balances(present_value, rate, payments, advance=None):
+    # Same recurrence for arbitrary (A, T) payment vectors:
+    # B_t = (1 + r) ** t * (B_0 - sum over s <= t of P_s / (1 + r) ** s).
+    present_value = np.asarray(present_value, dtype=np.float64)[:, np.newaxis]
+    growth = 1 + np.asarray(rate, dtype=np.float64)[:, np.newaxis]
+    t = np.arange(payments.shape[1] + 1)
+    discounted = np.concatenate(
+        [np.zeros((payments.shape[0], 1)),
+         np.cumsum(_advance_growth(growth, advance) * payments * growth ** -t[1:], axis=1)],
+        axis=1,
+    )
+    return growth ** t * (present_value - discounted)
+
+
+def runs_matrix(runs, width):
+    # (A, width) payments from each lease's payment runs.
+    payments = np.zeros((len(runs), width))
+    for row, lease_runs in enumerate(runs):
+        for first, last, amount in lease_runs:
+            payments[row, first - 1:last] = float(amount)
+    return payments
+
+
+def lease_rollforward(start_dates, step_months, total_periods, present_value, rate, payment, changing_amount,
+                      changed_from, rou_initial, start, end, runs=None, advance=None):
+    # Liability and ROU movements of every lease over [start, end], counting
+    # the periods dated within it. Leases commencing in the range enter
+    # through additions, so closing = opening + additions + interest - payments
+    # + remeasurements and closing_rou = opening_rou + rou_additions
+    # + rou_remeasurements - rou_depreciation. The closed forms follow one set
+    # of terms, so their remeasurements are zero.
+    # With runs (escalated payment vectors) the balances come from the
+    # general recurrence, otherwise from the two-step closed form. advance
+    # flags the leases paid in advance, whose interest accrues on the opening
+    # balance less the period's payment.
+    dates, valid = lease_period_dates(start_dates, step_months, total_periods)
+    if runs is None:
+        balances, payments = amortization_balances(
+            present_value, rate, payment, changing_amount, changed_from, dates.shape[1], advance
+        )
+    else:
+        payments = runs_matrix(runs, dates.shape[1])
+        balances = escalated_balances(present_value, rate, payments, advance)
+    start = np.datetime64(start, 'D')
+    end = np.datetime64(end, 'D')
+
+    commencement = np.asarray(start_dates, dtype='datetime64[D]')
+    existing = commencement < start
+    added = ~existing & (commencement <= end)
+    elapsed_before = (valid & (dates < start)).sum(axis=1)
+    elapsed_by_end = (valid & (dates <= end)).sum(axis=1)
+    in_range = valid & (dates >= start) & (dates <= end)
+
+    def balance_after(elapsed):
+        return np.take_along_axis(balances, elapsed[:, np.newaxis], axis=1)[:, 0]
+
+    total_periods = np.asarray(total_periods, dtype=np.int64)
+    rou_initial = np.asarray(rou_initial, dtype=np.float64)
+    rou_charge = rou_initial / np.maximum(total_periods, 1)
+
+    def rou_after(elapsed):
+        remaining = rou_initial - rou_charge * elapsed
+        return np.where((total_periods > 0) & (elapsed >= total_periods), 0.0, remaining)
+
+    rate = np.asarray(rate, dtype=np.float64)[:, np.newaxis]
+    accruing = balances[:, :-1]
+    if advance is not None:
+        accruing = accruing - np.where(np.asarray(advance, dtype=bool)[:, np.newaxis], payments, 0.0)
+    opening_rou = np.where(existing, rou_after(elapsed_before), 0.0)
+    rou_additions = np.where(added, rou_initial, 0.0)
+    closing_rou = np.where(existing | added, rou_after(elapsed_by_end), 0.0)
+    return {
+        'opening_liability': np.where(existing, balance_after(elapsed_before), 0.0),
+        'additions': np.where(added, balances[:, 0], 0.0),
+        'interest': np.where(in_range, accruing * rate, 0.0).sum(axis=1),
+        'payments': np.where(in_range, payments, 0.0).sum(axis=1),
+        'remeasurements': np.zeros(len(total_periods)),
+        'closing_liability': np.where(existing | added, balance_after(elapsed_by_end), 0.0),
+        'opening_rou': opening_rou,
+        'rou_additions': rou_additions,
+        'rou_remeasurements': np.zeros(len(total_periods)),
+        'rou_depreciation': opening_rou + rou_additions - closing_rou,
+        'closing_rou': closing_rou,
+    }
@@ -0,0 +1,266 @@
+from datetime import timedelta
+
+from django.db import transaction
+
+from ..models import (
+    Account,
+    GeneralLedger,
+    LeaseAmortizationSchedule,
+    LeaseFinancial,
+    LeaseRemeasurement,
+    LeaseRouSchedule,
+)
+from .lease import first_changed_period, lease_rollforward
+
+
+LEASE_ROLLFORWARD_FIELDS = LeaseFinancial.SCHEDULE_FIELDS + ['lease', 'present_value', 'escalation_factors']
+
+
+def calculate_lease_rollforward(start, end, queryset=None):
+    # Portfolio roll-forward over [start, end]: per-lease terms are read once,
+    # the schedule math runs vectorized across every lease.
+    if queryset is None:
+        queryset = LeaseFinancial.objects.all()
+    leases = list(queryset.order_by('pk').only(*LEASE_ROLLFORWARD_FIELDS))
+    if not leases:
+        return [], None
+
+    start_dates, steps, totals, rates, changed_from, rou_initial, runs = [], [], [], [], [], [], []
+    for lease in leases:
+        is_yearly, periodic_rate, total_periods, change_at_period = lease.get_payment_terms()
+        start_dates.append(lease.start_date)
+        steps.append(12 if is_yearly else 1)
+        totals.append(total_periods)
+        rates.append(float(periodic_rate))
+        changed_from.append(first_changed_period(change_at_period, total_periods))
+        rou_initial.append(float(lease.get_initial_rou()))
+        runs.append(lease.get_payment_runs())
+
+    rollforward = lease_rollforward(
+        start_dates, steps, totals,
+        [float(lease.present_value or 0) for lease in leases], rates,
+        [float(lease.payment_frequency) for lease in leases],
+        [float(lease.changing_amount) for lease in leases],
+        changed_from, rou_initial, start, end, runs,
+        [lease.payment_timing == 'Advance' for lease in leases],
+    )
+
+    remeasured = _stored_lease_rollforward(leases, start, end)
+    for index, lease in enumerate(leases):
+        for key, value in remeasured.get(lease.pk, {}).items():
+            rollforward[key][index] = value
+    return [(lease.pk, lease.lease_id) for lease in leases], rollforward
+
+
+def _stored_lease_rollforward(leases, start, end):
+    # Remeasured leases roll forward from their stored rows: the closed forms
+    # only know the current terms, while the rows up to a remeasurement were
+    # recognised under the earlier ones. {financial_id: {key: value}}.
+    remeasurements = {}
+    for remeasurement in (
+        LeaseRemeasurement.objects.filter(financial_id__in=[lease.pk for lease in leases]).order_by('remeasurement_id')
+    ):
+        # A later remeasurement from an earlier period replaced this one's rows.
+        kept = remeasurements.setdefault(remeasurement.financial_id, [])
+        kept[:] = [item for item in kept if item.effective_period < remeasurement.effective_period]
+        kept.append(remeasurement)
+    if not remeasurements:
+        return {}
+
+    amortization, rou = {}, {}
+    for financial_id, *row in (
+        LeaseAmortizationSchedule.objects.filter(financial_id__in=remeasurements).order_by('financial_id', 'period')
+        .values_list('financial_id', 'date', 'opening_balance', 'payment', 'interest', 'closing_balance')
+    ):
+        amortization.setdefault(financial_id, []).append(row)
+    for financial_id, *row in (
+        LeaseRouSchedule.objects.filter(financial_id__in=remeasurements).order_by('financial_id', 'period')
+        .values_list('financial_id', 'date', 'opening_rou', 'closing_rou')
+    ):
+        rou.setdefault(financial_id, []).append(row)
+
+    def balance_on(rows, before):
+        # Closing balance of the last row dated before `before`, the opening
+        # balance while none is.
+        balance = rows[0][1]
+        for row in rows:
+            if row[0] >= before:
+                break
+            balance = row[-1]
+        return float(balance)
+
+    results = {}
+    for lease in leases:
+        rows = amortization.get(lease.pk)
+        if lease.pk not in remeasurements or not rows:
+            continue
+        rou_rows = rou[lease.pk]
+        existing = lease.start_date < start
+        added = not existing and lease.start_date <= end
+        after_end = end + timedelta(days=1)
+        in_range = [row for row in rows if start <= row[0] <= end]
+        changes = [
+            item for item in remeasurements[lease.pk]
+            if item.effective_period < len(rows) and start <= rows[item.effective_period][0] <= end
+        ]
+
+        opening_rou = balance_on(rou_rows, start) if existing else 0.0
+        rou_additions = float(rou_rows[0][1]) if added else 0.0
+        rou_remeasurements = float(sum(item.rou_adjustment for item in changes))
+        closing_rou = balance_on(rou_rows, after_end) if existing or added else 0.0
+        results[lease.pk] = {
+            'opening_liability': balance_on(rows, start) if existing else 0.0,
+            'additions': float(rows[0][1]) if added else 0.0,
+            'interest': float(sum(row[3] for row in in_range)),
+            'payments': float(sum(row[2] for row in in_range)),
+            'remeasurements': float(sum(item.remeasured_liability - item.carried_liability for item in changes)),
+            'closing_liability': balance_on(rows, after_end) if existing or added else 0.0,
+            'opening_rou': opening_rou,
+            'rou_additions': rou_additions,
+            'rou_remeasurements': rou_remeasurements,
+            'rou_depreciation': opening_rou + rou_additions + rou_remeasurements - closing_rou,
+            'closing_rou': closing_rou,
+        }
+    return results
+
+
+LEASE_GL_ACCOUNTS = {
+    'interest': ('Lease Interest Expense', 'Expense'),
+    'liability': ('Lease Liability', 'Liability'),
+    'payable': ('Lease Payable', 'Liability'),
+    'depreciation': ('ROU Depreciation Expense', 'Expense'),
+    'accumulated': ('ROU Accumulated Depreciation', 'Asset'),
+}
+ACTIVE_LEASE_STATUSES = ['Active', 'Amendment']
+
+
+def _lease_gl_accounts():
+    names = dict(LEASE_GL_ACCOUNTS.values())
+    accounts = {}
+    for account in Account.objects.filter(account_name__in=names).order_by('account_id'):
+        accounts.setdefault(account.account_name, account)
+
+    for name, account_type in names.items():
+        if name not in accounts:
+            accounts[name] = Account.objects.create(account_name=name, account_type=account_type)
+    return {line: accounts[name] for line, (name, _) in LEASE_GL_ACCOUNTS.items()}
+
+
+def _lease_journal_line(posting_key, account, amount, debit, **fields):
+    # A negative amount (e.g. negative amortization) goes on the other side.
+    amount = float(amount)
+    if amount < 0:
+        amount, debit = -amount, not debit
+    return GeneralLedger(
+        posting_key=posting_key,
+        account=account,
+        account_code=account.account_code,
+        debit_amount=amount if debit else 0,
+        credit_amount=0 if debit else amount,
+        **fields,
+    )
+
+
+def regenerate_missing_lease_schedules(financial_ids):
+    # Leases without stored rows (saved before the schedules were persisted)
+    # would post nothing; builds theirs first. Returns how many it built.
+    stored = set(
+        LeaseAmortizationSchedule.objects.filter(financial_id__in=financial_ids)
+        .values_list('financial_id', flat=True).distinct()
+    )
+    missing = [financial_id for financial_id in financial_ids if financial_id not in stored]
+    if not missing:
+        return 0
+
+    regenerated = 0
+    for lease in LeaseFinancial.objects.filter(pk__in=missing, lease_term__gt=0).order_by('pk'):
+        lease.backfill_schedules()
+        regenerated += 1
+    return regenerated
+
+
+def post_lease_journals(period_end, period_start=None, chunk_size=500):
+    # Period close for leases: for every schedule period of an active lease
+    # dated within [period_start, period_end], posts
+    #   Dr interest expense, Dr lease liability (principal), Cr lease payable
+    #   Dr ROU depreciation, Cr ROU accumulated depreciation
+    # from the stored schedules, building those of leases that have none.
+    # Each line carries a posting_key unique per (lease, period, line), so
+    # re-running a period posts nothing new.
+    period_start = period_start or period_end.replace(day=1)
+    gl_code = period_end.year * 100 + period_end.month
+    accounts = _lease_gl_accounts()
+
+    queryset = (
+        LeaseFinancial.objects.filter(lease__status__in=ACTIVE_LEASE_STATUSES)
+        .order_by('pk').values_list('pk', flat=True)
+    )
+    report = {
+        'leases': 0, 'periods': 0, 'created': 0, 'skipped': 0, 'regenerated': 0,
+        'interest': 0.0, 'payments': 0.0, 'depreciation': 0.0,
+    }
+    last_id = 0
+    while True:
+        financial_ids = list(queryset.filter(pk__gt=last_id)[:chunk_size])
+        if not financial_ids:
+            break
+        last_id = financial_ids[-1]
+        report['regenerated'] += regenerate_missing_lease_schedules(financial_ids)
+
+        in_period = {'financial_id__in': financial_ids, 'date__gte': period_start, 'date__lte': period_end}
+        amortization = {
+            (financial_id, period): (gl_date, payment, interest)
+            for financial_id, period, gl_date, payment, interest in LeaseAmortizationSchedule.objects
+            .filter(**in_period).values_list('financial_id', 'period', 'date', 'payment', 'interest')
+        }
+        depreciation = {
+            (financial_id, period): (gl_date, amount)
+            for financial_id, period, gl_date, amount in LeaseRouSchedule.objects
+            .filter(**in_period).values_list('financial_id', 'period', 'date', 'depreciation')
+        }
+
+        lines = []
+        for financial_id, period in sorted(amortization.keys() | depreciation.keys()):
+            prefix = f"LEASE-{financial_id}-{period}"
+            common = {'gl_code': gl_code, 'source_type': 'LEASE', 'source_id': financial_id}
+            if (financial_id, period) in amortization:
+                gl_date, payment, interest = amortization[(financial_id, period)]
+                common['gl_date'] = gl_date
+                description = f"Lease {financial_id} period {period}"
+                lines += [
+                    _lease_journal_line(f"{prefix}-INT", accounts['interest'], interest, True,
+                                        ref_type='Interest', description=f"{description} interest", **common),
+                    _lease_journal_line(f"{prefix}-LIA", accounts['liability'], payment - interest, True,
+                                        ref_type='Lease Payment', description=f"{description} principal", **common),
+                    _lease_journal_line(f"{prefix}-PAY", accounts['payable'], payment, False,
+                                        ref_type='Lease Payment', description=f"{description} payment", **common),
+                ]
+                report['interest'] += float(interest)
+                report['payments'] += float(payment)
+            if (financial_id, period) in depreciation:
+                gl_date, amount = depreciation[(financial_id, period)]
+                common['gl_date'] = gl_date
+                description = f"Lease {financial_id} period {period} ROU depreciation"
+                lines += [
+                    _lease_journal_line(f"{prefix}-DEP", accounts['depreciation'], amount, True,
+                                        ref_type='Depreciation', description=description, **common),
+                    _lease_journal_line(f"{prefix}-ACC", accounts['accumulated'], amount, False,
+                                        ref_type='Depreciation', description=description, **common),
+                ]
+                report['depreciation'] += float(amount)
+            report['periods'] += 1
+        report['leases'] += len({financial_id for financial_id, _ in amortization.keys() | depreciation.keys()})
+
+        posted = set(
+            GeneralLedger.objects.filter(posting_key__in=[line.posting_key for line in lines])
+            .values_list('posting_key', flat=True)
+        )
+        new_lines = [line for line in lines if line.posting_key not in posted]
+        with transaction.atomic():
+            GeneralLedger.objects.bulk_create(new_lines, batch_size=1000, ignore_conflicts=True)
+        report['created'] += len(new_lines)
+        report['skipped'] += len(lines) - len(new_lines)
+
+    for key in ('interest', 'payments', 'depreciation'):
+        report[key] = round(report[key], 2)
+    return report
@@ -0,0 +1,144 @@
+from datetime import date
+import numpy as np
+
+from ..models import FixedAssetRegister, get_default_convention
+from ..policies import policy_resolver
+from .depreciation import get_forecast_period_ends, portfolio_depreciation, portfolio_forecast
+
+
+def calculate_portfolio_nbv(queryset=None, as_of=None):
+    if queryset is None:
+        queryset = FixedAssetRegister.objects.all()
+
+    rows = list(queryset.values_list(
+        'register_id', 'asset_status', 'depreciation_method', 'total_amount',
+        'residual_value', 'useful_life', 'period', 'computation', 'capitalization_date'
+    ))
+    if not rows:
+        return {}
+
+    register_ids, statuses, methods, totals, residuals, lives, periods, computations, dates = zip(*rows)
+    accumulated, nbv = portfolio_depreciation(
+        methods, totals, residuals, lives, periods, computations, dates, as_of, get_default_convention()
+    )
+
+    results = {}
+    for index, register_id in enumerate(register_ids):
+        if statuses[index] == 'No Depreciation':
+            results[register_id] = (0.0, round(totals[index], 2))
+        else:
+            results[register_id] = (float(accumulated[index]), float(nbv[index]))
+    return results
+
+
+def forecast_portfolio_nbv(queryset=None, periods=12, frequency='MONTH', start=None):
+    if queryset is None:
+        queryset = FixedAssetRegister.objects.all()
+    start = start or date.today()
+    period_ends = get_forecast_period_ends(start, periods, frequency)
+
+    rows = list(queryset.order_by('register_id').values_list(
+        'register_id', 'asset_status', 'depreciation_method', 'total_amount', 'residual_value',
+        'useful_life', 'period', 'computation', 'capitalization_date'
+    ))
+    if not rows:
+        return period_ends, [], None
+
+    register_ids, statuses, methods, totals, residuals, lives, periods_, computations, dates = zip(*rows)
+    accumulated, charge, nbv = portfolio_forecast(
+        methods, totals, residuals, lives, periods_, computations, dates, period_ends, start,
+        get_default_convention()
+    )
+
+    # Same treatment as calculate_portfolio_nbv: these assets hold their cost.
+    frozen = np.asarray(statuses) == 'No Depreciation'
+    accumulated[:, frozen] = 0.0
+    charge[:, frozen] = 0.0
+    nbv[:, frozen] = np.round(np.asarray(totals, dtype=np.float64)[frozen], 2)
+
+    return period_ends, list(register_ids), {
+        'accumulated_depreciation': accumulated,
+        'period_charge': charge,
+        'nbv': nbv,
+    }
+
+
+MULTI_BOOK_FIELDS = (
+    'register_id', 'asset_status', 'account__account_code', 'account__account_name', 'depreciation_method',
+    'total_amount', 'residual_value', 'useful_life', 'period', 'computation', 'capitalization_date',
+)
+
+
+def calculate_multi_book_depreciation(queryset=None, as_of=None, book_ids=None):
+    # Every active book in one pass: the register is read once, policies come
+    # resolved from the policy cache, and each (book, convention) group is
+    # computed vectorized. A register has no Category of its own: it takes
+    # the one whose code or name is its account's current code, else name.
+    # Assets without one get the book's policy and a category_id of None.
+    if queryset is None:
+        queryset = FixedAssetRegister.objects.all()
+
+    book_ids = [book_id for book_id in policy_resolver.book_ids() if not book_ids or book_id in book_ids]
+    rows = list(queryset.order_by('register_id').values_list(*MULTI_BOOK_FIELDS))
+    if not rows or not book_ids:
+        return []
+    columns = {field: np.asarray(values, dtype=object) for field, values in zip(MULTI_BOOK_FIELDS, zip(*rows))}
+
+    asset_categories = np.array([
+        policy_resolver.category_for(code) or policy_resolver.category_for(name) or -1
+        for code, name in zip(columns['account__account_code'], columns['account__account_name'])
+    ])
+    cost = columns['total_amount'].astype(np.float64)
+    frozen = columns['asset_status'] == 'No Depreciation'
+
+    results = []
+    for book_id in book_ids:
+        book = policy_resolver.resolve(book_id)
+        inputs = {
+            field: columns[field].copy()
+            for field in ('depreciation_method', 'residual_value', 'useful_life', 'period')
+        }
+
+        groups = {}
+        for category_id in np.unique(asset_categories):
+            in_category = asset_categories == category_id
+            policy = policy_resolver.resolve(book_id, int(category_id))
+            for field, value in policy.overrides:
+                inputs[field][in_category] = value
+            groups[policy.convention] = groups.get(policy.convention, False) | in_category
+
+        accumulated = np.zeros(len(rows))
+        nbv = np.zeros(len(rows))
+        convention_names = np.full(len(rows), None, dtype=object)
+        for convention, members in groups.items():
+            convention_names[members] = convention.name if convention else None
+            accumulated[members], nbv[members] = portfolio_depreciation(
+                inputs['depreciation_method'][members],
+                cost[members],
+                inputs['residual_value'][members].astype(np.float64),
+                inputs['useful_life'][members].astype(np.int64),
+                inputs['period'][members],
+                columns['computation'][members],
+                columns['capitalization_date'][members],
+                as_of,
+                convention,
+            )
+        accumulated[frozen] = 0.0
+        nbv[frozen] = np.round(cost[frozen], 2)
+
+        for index, register_id in enumerate(columns['register_id']):
+            results.append({
+                'register_id': register_id,
+                'book_id': book_id,
+                'book_name': book.book_name,
+                'book_level': book.book_level,
+                'category_id': int(asset_categories[index]) if asset_categories[index] != -1 else None,
+                'depreciation_method': inputs['depreciation_method'][index],
+                'useful_life': inputs['useful_life'][index],
+                'period': inputs['period'][index],
+                'residual_value': inputs['residual_value'][index],
+                'convention': convention_names[index],
+                'accumulated_depreciation': float(accumulated[index]),
+                'current_nbv': float(nbv[index]),
+            })
+    return results
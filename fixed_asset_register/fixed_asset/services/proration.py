@@ -0,0 +1,304 @@
+from decimal import Decimal
+import calendar
+from datetime import date, datetime
+from functools import lru_cache
+import numpy as np
+
+EXACT_DATE_CONVENTION = 'Exact Date (IFRS - Daily Pro-rata)'
+MONTHLY_PRORATA_CONVENTION = 'Monthly Pro-rata'
+NO_ACQUISITION_YEAR_CONVENTION = 'Full-Year Convention - No Acquisition Year'
+NO_DISPOSAL_YEAR_CONVENTION = 'Full-Year Convention - No Disposal Year'
+HALF_YEAR_CONVENTION = 'Half-Year Convention'
+
+# How much of the acquisition and of the disposal period each convention
+# depreciates. Weights apply at the asset's computation grain (the calendar
+# year, month or day holding the date), except the half-year rules, which
+# always weigh the calendar year.
+CONVENTION_RULES = {
+    EXACT_DATE_CONVENTION: ('daily', 'daily'),
+    MONTHLY_PRORATA_CONVENTION: ('monthly', 'monthly'),
+    NO_ACQUISITION_YEAR_CONVENTION: ('none', 'full'),
+    NO_DISPOSAL_YEAR_CONVENTION: ('full', 'none'),
+    HALF_YEAR_CONVENTION: ('half', 'half'),
+}
+
+GRAINS = ('YEAR', 'MONTH', 'DAY')
+
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+def _as_date_array(dates):
+    return np.array([_as_date(value) for value in dates], dtype='datetime64[D]')
+
+
+def _date_parts(dates):
+    years = dates.astype('datetime64[Y]').astype(np.int64) + 1970
+    months = dates.astype('datetime64[M]').astype(np.int64) % 12 + 1
+    days = (dates - dates.astype('datetime64[M]')).astype(np.int64) + 1
+    return years, months, days
+
+
+def _days_in_month(years, months):
+    first = (years - 1970) * 12 + (months - 1)
+    start = first.astype('datetime64[M]').astype('datetime64[D]')
+    end = (first + 1).astype('datetime64[M]').astype('datetime64[D]')
+    return (end - start).astype(np.int64)
+
+
+def _weight_table(grain, kind, side):
+    # Returns (numerators, denominators), indexed by the position of a date in
+    # its period: [leap year, day of year - 1] for YEAR,
+    # [days in month - 28, day - 1] for MONTH and [0, 0] for DAY.
+    if grain == 'YEAR':
+        length = np.array([[365], [366]])
+        position = np.arange(1, 367)[np.newaxis, :]
+        month = np.stack([
+            (np.datetime64('2023-01-01') + np.arange(366)).astype('datetime64[M]').astype(np.int64) % 12 + 1,
+            (np.datetime64('2024-01-01') + np.arange(366)).astype('datetime64[M]').astype(np.int64) % 12 + 1,
+        ])
+    elif grain == 'MONTH':
+        length = np.arange(28, 32)[:, np.newaxis]
+        position = np.arange(1, 32)[np.newaxis, :]
+        month = None
+    else:
+        length = np.ones((1, 1), dtype=np.int64)
+        position = np.ones((1, 1), dtype=np.int64)
+        month = None
+
+    shape = np.broadcast_shapes(length.shape, position.shape)
+    denominators = np.broadcast_to(length, shape).copy()
+
+    if kind == 'none':
+        numerators = np.zeros(shape, dtype=np.int64)
+    elif kind == 'full':
+        numerators = denominators.copy()
+    elif kind == 'half':
+        numerators = np.ones(shape, dtype=np.int64)
+        denominators = np.full(shape, 2)
+    elif kind == 'monthly' and grain == 'YEAR':
+        # The acquisition month counts in full, the disposal month not at all.
+        numerators = 13 - month if side == 'acquisition' else month - 1
+        denominators = np.full(shape, 12)
+    elif kind == 'monthly':
+        numerators = denominators.copy() if side == 'acquisition' else np.zeros(shape, dtype=np.int64)
+    elif side == 'acquisition':
+        # daily: from the acquisition date to the end of its period.
+        numerators = np.maximum(denominators - position + 1, 0)
+    else:
+        # daily: up to, but not including, the disposal date.
+        numerators = np.minimum(position - 1, denominators)
+
+    return numerators.astype(np.int64), denominators.astype(np.int64)
+
+
+class ProrationTable:
+    def __init__(self, name, acquisition_kind, disposal_kind):
+        self.name = name
+        self.acquisition_kind = acquisition_kind
+        self.disposal_kind = disposal_kind
+        self.acquisition = {grain: _weight_table(grain, acquisition_kind, 'acquisition') for grain in GRAINS}
+        self.disposal = {grain: _weight_table(grain, disposal_kind, 'disposal') for grain in GRAINS}
+
+    def __repr__(self):
+        return f"<ProrationTable {self.name}: {self.acquisition_kind}/{self.disposal_kind}>"
+
+    def weight(self, side, value, grain):
+        numerators, denominators = getattr(self, side)[grain]
+        row, column = _position(value, grain)
+        return Decimal(int(numerators[row, column])) / Decimal(int(denominators[row, column]))
+
+    def weight_array(self, side, values, grain):
+        numerators, denominators = getattr(self, side)[grain]
+        row, column = _position_array(values, grain)
+        return numerators[row, column] / denominators[row, column]
+
+
+@lru_cache(maxsize=None)
+def compile_convention(name, apply_prorata_acquisition=False, apply_prorata_disposal=False,
+                       full_depre_in_acquisition_yr=False, no_depre_in_disposal_yr=False,
+                       start_from_next_financial_yr=False):
+    acquisition, disposal = CONVENTION_RULES.get(name, ('full', 'full'))
+
+    # ConventionList flags refine the named convention.
+    if apply_prorata_acquisition and acquisition not in ('daily', 'monthly'):
+        acquisition = 'daily'
+    if apply_prorata_disposal and disposal not in ('daily', 'monthly'):
+        disposal = 'daily'
+    if full_depre_in_acquisition_yr:
+        acquisition = 'full'
+    if start_from_next_financial_yr:
+        acquisition = 'none'
+    if no_depre_in_disposal_yr:
+        disposal = 'none'
+
+    return ProrationTable(name, acquisition, disposal)
+
+
+def _position(value, grain):
+    if grain == 'YEAR':
+        return int(calendar.isleap(value.year)), value.timetuple().tm_yday - 1
+    if grain == 'MONTH':
+        return calendar.monthrange(value.year, value.month)[1] - 28, value.day - 1
+    return 0, 0
+
+
+def _position_array(values, grain):
+    if grain == 'YEAR':
+        years = values.astype('datetime64[Y]')
+        days_in_year = ((years + 1).astype('datetime64[D]') - years.astype('datetime64[D]')).astype(np.int64)
+        return days_in_year - 365, (values - years.astype('datetime64[D]')).astype(np.int64)
+    if grain == 'MONTH':
+        years, months, days = _date_parts(values)
+        return _days_in_month(years, months) - 28, days - 1
+    zeros = np.zeros(values.shape, dtype=np.int64)
+    return zeros, zeros
+
+
+def _period_index(value, grain):
+    if grain == 'YEAR':
+        return value.year
+    if grain == 'MONTH':
+        return value.year * 12 + value.month - 1
+    return value.toordinal()
+
+
+def _period_index_array(values, grain):
+    if grain == 'YEAR':
+        return values.astype('datetime64[Y]').astype(np.int64)
+    if grain == 'MONTH':
+        return values.astype('datetime64[M]').astype(np.int64)
+    return values.astype(np.int64)
+
+
+def _year_units(year, grain):
+    # Units of the given grain in a calendar year.
+    if grain == 'MONTH':
+        return Decimal(12)
+    return Decimal(366 if calendar.isleap(year) else 365)
+
+
+def _year_units_array(years, grain):
+    if grain == 'MONTH':
+        return np.full(years.shape, 12.0)
+    starts = (years - 1970).astype('datetime64[Y]')
+    return ((starts + 1).astype('datetime64[D]') - starts.astype('datetime64[D]')).astype(np.float64)
+
+
+def _acquisition_span(table, start, grain):
+    # (periods, units): the acquisition takes its own period at the table
+    # weight. A half-year rule weighs the whole calendar year instead, so at
+    # a month or day grain the rest of the acquisition year accrues half a
+    # year between them.
+    if table.acquisition_kind == 'half' and grain != 'YEAR':
+        periods = _period_index(date(start.year + 1, 1, 1), grain) - _period_index(start, grain)
+        return periods, _year_units(start.year, grain) / 2
+    return 1, table.weight('acquisition', start, grain)
+
+
+def _running_units(first_periods, first_units, closed):
+    if closed >= first_periods:
+        return first_units + closed - first_periods
+    return first_units * closed / first_periods
+
+
+def prorated_units(table, capitalization_date, computation, total_units, as_of=None, disposal_date=None):
+    # Convention-weighted counterpart of get_elapsed_units, counted in calendar
+    # periods: the acquisition period contributes its table weight once it has
+    # closed, every later closed period one unit, and a disposal period its
+    # disposal weight. Half-year rules apply to the calendar year whatever the
+    # grain. Returns (units, acquisition weight in units) as Decimals.
+    grain = computation.upper()
+    start = _as_date(capitalization_date)
+    if not start or total_units <= 0:
+        return Decimal("0"), Decimal("1")
+
+    end = _as_date(as_of or date.today())
+    first_periods, first = _acquisition_span(table, start, grain)
+    disposal_date = _as_date(disposal_date)
+
+    if disposal_date is not None and disposal_date <= end and table.disposal_kind == 'half' and grain != 'YEAR':
+        half = _year_units(disposal_date.year, grain) / 2
+        if disposal_date.year == start.year:
+            units = first + half - _year_units(disposal_date.year, grain)
+        else:
+            year_start = date(disposal_date.year, 1, 1)
+            closed = _period_index(year_start, grain) - _period_index(start, grain)
+            units = _running_units(first_periods, first, closed) + half
+    elif disposal_date is not None and disposal_date <= end:
+        units = (
+            first + (_period_index(disposal_date, grain) - _period_index(start, grain) - first_periods)
+            + table.weight('disposal', disposal_date, grain)
+        )
+    else:
+        closed = _period_index(end, grain) - _period_index(start, grain)
+        units = _running_units(first_periods, first, closed) if closed > 0 else Decimal("0")
+
+    return min(max(units, Decimal("0")), Decimal(total_units)), first
+
+
+def prorated_units_array(table, capitalization_date, computation, total_units, as_of=None, disposal_date=None):
+    # Vectorized prorated_units. as_of may be a scalar date or a datetime64
+    # array that broadcasts against the assets (one row per forecast date).
+    start = _as_date_array(capitalization_date)
+    computation = np.char.upper(np.asarray(computation, dtype=str))
+    if isinstance(as_of, np.ndarray):
+        end = as_of.astype('datetime64[D]')
+    else:
+        end = np.datetime64(_as_date(as_of or date.today()), 'D')
+    missing = np.isnat(start)
+    start = np.where(missing, np.datetime64('1970-01-01'), start)
+
+    if disposal_date is None:
+        disposed_on = np.full(start.shape, np.datetime64('NaT'), dtype='datetime64[D]')
+    else:
+        disposed_on = _as_date_array(disposal_date)
+    disposed = ~np.isnat(disposed_on) & (disposed_on <= end)
+    disposed_on = np.where(np.isnat(disposed_on), start, disposed_on)
+
+    start_year = start.astype('datetime64[Y]')
+    disposal_year = disposed_on.astype('datetime64[Y]')
+
+    def running(first_periods, first_units, closed):
+        return np.where(
+            closed >= first_periods, first_units + closed - first_periods, first_units * closed / first_periods
+        )
+
+    first = np.ones(start.shape)
+    units = np.zeros(np.broadcast_shapes(start.shape, np.shape(end)))
+    for grain in GRAINS:
+        mask = computation == grain
+        if not mask.any():
+            continue
+        start_index = _period_index_array(start, grain)
+        year_level = grain != 'YEAR'
+        if table.acquisition_kind == 'half' and year_level:
+            first_periods = _period_index_array((start_year + 1).astype('datetime64[D]'), grain) - start_index
+            grain_first = _year_units_array(start_year.astype(np.int64) + 1970, grain) / 2
+        else:
+            first_periods = 1
+            grain_first = table.weight_array('acquisition', start, grain)
+        first = np.where(mask, grain_first, first)
+
+        closed = _period_index_array(end, grain) - start_index
+        current = np.where(closed > 0, running(first_periods, grain_first, closed), 0.0)
+        if table.disposal_kind == 'half' and year_level:
+            year_units = _year_units_array(disposal_year.astype(np.int64) + 1970, grain)
+            before = _period_index_array(disposal_year.astype('datetime64[D]'), grain) - start_index
+            at_disposal = np.where(
+                disposal_year == start_year,
+                grain_first - year_units / 2,
+                running(first_periods, grain_first, before) + year_units / 2,
+            )
+        else:
+            at_disposal = (
+                grain_first + (_period_index_array(disposed_on, grain) - start_index - first_periods)
+                + table.weight_array('disposal', disposed_on, grain)
+            )
+        units = np.where(mask, np.where(disposed, at_disposal, current), units)
+
+    units = np.where(missing, 0.0, units)
+    return np.clip(units, 0, total_units), first
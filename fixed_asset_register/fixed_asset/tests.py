@@ -1,3 +1,1313 @@
-from django.test import TestCase
+import csv
+import json
+import os
+import random
+import tempfile
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from itertools import product
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from dateutil.relativedelta import relativedelta
+
+from django.core.management import call_command
+from django.db.models.signals import post_save
+from django.test import SimpleTestCase, TestCase
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from .benchmarks import _lease, BASELINE_PATH, build_cases, find_regressions, run_benchmarks
+from .management.commands.refresh_current_nbv import Command as RefreshCurrentNbvCommand
+from .models import (
+    Account,
+    AssetBook,
+    AssetCategoryPolicy,
+    AssetPolicy,
+    BookLevelPolicy,
+    Category,
+    Company,
+    Department,
+    Depreciation,
+    DepreciationAuditLog,
+    DepreciationEvent,
+    FixedAssetRegister,
+    GeneralLedger,
+    LeaseAmortizationSchedule,
+    LeaseContract,
+    LeaseFinancial,
+    LeaseRemeasurement,
+    LeaseRouSchedule,
+    SystemDefault,
+    Users,
+)
+from .policies import _resolve, policy_resolver
+from .serializers import LeaseFinancialSerializer
+from .services.lease import (
+    amortization_balances,
+    amortization_columns,
+    annuity_present_value,
+    escalated_balances,
+    expand_runs,
+    first_changed_period,
+    lease_rollforward,
+    payment_runs,
+    percent_factors,
+    rou_columns,
+    round_columns,
+    runs_matrix,
+    runs_present_value,
+    schedule_dates,
+    schedule_rows,
+)
+from . import views
+from .views import DepreciationCalculationAPI, PeriodEndDepreciationAPI
+from .services.depreciation import (
+    _cached_depreciation,
+    cached_depreciation,
+    calculate_depreciation,
+    double_declining,
+    double_declining_float,
+    FLOAT_BACKEND,
+    FLOAT_MAX_DIVERGENCE,
+    get_elapsed_units,
+    get_forecast_period_ends,
+    get_elapsed_units_array,
+    get_periodic_rate,
+    get_total_units,
+    get_total_units_array,
+    incremental_depreciation,
+    portfolio_depreciation,
+    portfolio_forecast,
+    reducing_balance,
+    reducing_balance_float,
+    straight_line,
+    straight_line_float,
+)
+from .services import depreciation_runs, portfolio
+from .services.depreciation_runs import (
+    _merge_run_report,
+    _new_run_report,
+    _post_depreciation_chunk,
+    DEPRECIATION_PREVIEW_COLUMNS,
+    get_depreciation_partitions,
+    refresh_current_nbv,
+    run_period_depreciation,
+    stream_depreciation_preview,
+)
+from .services.lease_close import _lease_journal_line, calculate_lease_rollforward, post_lease_journals
+from .services.proration import (
+    compile_convention,
+    CONVENTION_RULES,
+    EXACT_DATE_CONVENTION,
+    HALF_YEAR_CONVENTION,
+    MONTHLY_PRORATA_CONVENTION,
+    prorated_units,
+    prorated_units_array,
+)
+
+
+def loop_declining_nbv(cost, residual, rate, elapsed_units, floor_on_equal=False):
+    nbv = cost
+    for _ in range(int(elapsed_units)):
+        depreciation = nbv * rate
+        nbv -= depreciation
+        if nbv < residual or (floor_on_equal and nbv == residual):
+            nbv = residual
+            break
+    return nbv
+
+
+def loop_reducing_balance(total_amount, residual_value, useful_life, elapsed_units, computation):
+    cost = Decimal(str(total_amount))
+    residual = Decimal(str(residual_value))
+    if useful_life <= 0 or elapsed_units <= 0:
+        return Decimal("0.00")
+    annual_rate = Decimal("1") - (residual / cost) ** (Decimal("1") / Decimal(str(useful_life)))
+    rate = get_periodic_rate(annual_rate, computation)
+    nbv = loop_declining_nbv(cost, residual, rate, elapsed_units)
+    return (cost - nbv).quantize(Decimal("0.01"))
+
+
+def loop_double_declining(total_amount, residual_value, useful_life, elapsed_units, computation):
+    cost = Decimal(str(total_amount))
+    residual = Decimal(str(residual_value))
+    annual_rate = Decimal("2") / Decimal(str(useful_life))
+    rate = get_periodic_rate(annual_rate, computation)
+    nbv = loop_declining_nbv(cost, residual, rate, elapsed_units)
+    return (cost - nbv).quantize(Decimal("0.01"))
+
+
+UNITS_PER_YEAR = {'YEAR': 1, 'MONTH': 12, 'DAY': 365}
+
+
+def create_lease(code, start_date, lease_term=5, **terms):
+    contract = LeaseContract.objects.create(
+        code=code, lease_type='Building', leasor_name='Landlord', contract_date=start_date,
+        commencement_date=start_date, expiry_date=start_date + relativedelta(years=lease_term),
+        extension_years=0, termination_certain_date=start_date + relativedelta(years=lease_term),
+    )
+    fields = dict(
+        contract_amount=Decimal('0'), deposit=Decimal('0'), down_payment=Decimal('0'), other_cost=Decimal('0'),
+        dismantling_cost=Decimal('0'), currency='USD', home_currency='USD', exchange_rate=Decimal('1'),
+        start_date=start_date, end_date=start_date + relativedelta(years=lease_term), lease_term=lease_term,
+        lease_period='Year', discount_rate=6.0, payment_frequency=Decimal('1000.00'), payment_period='Monthly',
+        computation='Monthly', payment_timing='Arrears', discount_rate_type='IBR', escalation_type='None',
+    )
+    fields.update(terms)
+    return LeaseFinancial.objects.create(lease=contract, **fields)
+
+
+class DecliningBalanceParityTest(SimpleTestCase):
+    amounts = [1000, 123456.78, 9999999.99, 250000000]
+    residual_ratios = [0, 0.05, 0.1, 0.5]
+    lives = [1, 3, 5, 10, 25]
+
+    def elapsed_points(self, useful_life, computation):
+        total = useful_life * UNITS_PER_YEAR[computation]
+        points = {0, 1, 2, total // 3, total // 2, total - 1, total, total + 7}
+        return sorted(p for p in points if p >= 0)
+
+    def test_reducing_balance_matches_loop(self):
+        for amount, ratio, life, computation in product(
+            self.amounts, self.residual_ratios, self.lives, UNITS_PER_YEAR
+        ):
+            residual = round(amount * ratio, 2)
+            if residual == 0:
+                # The reducing-balance rate is undefined without a residual.
+                continue
+            for elapsed in self.elapsed_points(life, computation):
+                with self.subTest(amount=amount, residual=residual, life=life,
+                                  computation=computation, elapsed=elapsed):
+                    self.assertEqual(
+                        reducing_balance(amount, residual, life, elapsed, computation),
+                        loop_reducing_balance(amount, residual, life, elapsed, computation),
+                    )
+
+    def test_double_declining_matches_loop(self):
+        for amount, ratio, life, computation in product(
+            self.amounts, self.residual_ratios, self.lives, UNITS_PER_YEAR
+        ):
+            residual = round(amount * ratio, 2)
+            for elapsed in self.elapsed_points(life, computation):
+                with self.subTest(amount=amount, residual=residual, life=life,
+                                  computation=computation, elapsed=elapsed):
+                    self.assertEqual(
+                        double_declining(amount, residual, life, elapsed, computation),
+                        loop_double_declining(amount, residual, life, elapsed, computation),
+                    )
+
+    def test_register_copies_match_loop(self):
+        for amount, ratio, life, computation in product(
+            self.amounts, self.residual_ratios[1:], self.lives, UNITS_PER_YEAR
+        ):
+            residual = round(amount * ratio, 2)
+            for elapsed in self.elapsed_points(life, computation):
+                with self.subTest(amount=amount, residual=residual, life=life,
+                                  computation=computation, elapsed=elapsed):
+                    self.assertEqual(
+                        FixedAssetRegister.reducing_balance(amount, residual, life, elapsed, computation),
+                        float(loop_reducing_balance(amount, residual, life, elapsed, computation)),
+                    )
+
+                    cost = Decimal(str(amount))
+                    rate = get_periodic_rate(Decimal("2") / Decimal(str(life)), computation)
+                    expected = cost - loop_declining_nbv(
+                        cost, Decimal(str(residual)), rate, elapsed, floor_on_equal=True
+                    )
+                    self.assertEqual(
+                        FixedAssetRegister.double_declining(amount, residual, life, elapsed, computation),
+                        expected.quantize(Decimal("0.01")),
+                    )
+
+
+class PortfolioDepreciationTest(SimpleTestCase):
+    methods = ['Straight Line', 'Reducing Balance', 'Double Declining']
+    units = ['DAY', 'MONTH', 'YEAR']
+
+    def random_assets(self, count):
+        rng = random.Random(42)
+        today = date.today()
+        assets = []
+        for _ in range(count):
+            total = round(rng.uniform(100, 5000000), 2)
+            assets.append(FixedAssetRegister(
+                asset_status='Ready to Use',
+                depreciation_method=rng.choice(self.methods),
+                total_amount=total,
+                residual_value=round(total * rng.choice([0.01, 0.05, 0.1, 0.2]), 2),
+                useful_life=rng.randint(1, 50),
+                period=rng.choice(self.units),
+                computation=rng.choice(self.units),
+                capitalization_date=datetime.combine(
+                    today - timedelta(days=rng.randint(-30, 20000)), datetime.min.time()
+                ),
+            ))
+        return assets
+
+    def test_unit_arrays_match_scalar(self):
+        today = date.today()
+        starts = [today - timedelta(days=offset) for offset in range(-3, 1200, 7)]
+        starts += [date(2024, 1, 31), date(2023, 2, 28), date(2020, 2, 29), date(2021, 8, 31)]
+        for computation in self.units:
+            elapsed = get_elapsed_units_array(starts, [computation] * len(starts))
+            for start, value in zip(starts, elapsed):
+                with self.subTest(start=start, computation=computation):
+                    self.assertEqual(value, get_elapsed_units(start, computation))
+
+        for life, period, computation in product([0, 1, 7, 40], self.units, self.units):
+            with self.subTest(life=life, period=period, computation=computation):
+                self.assertEqual(
+                    get_total_units_array([life], [period], [computation])[0],
+                    get_total_units(life, period, computation),
+                )
+
+    def test_matches_calculate_current_nbv(self):
+        assets = self.random_assets(500)
+        accumulated, nbv = portfolio_depreciation(
+            [a.depreciation_method for a in assets],
+            [a.total_amount for a in assets],
+            [a.residual_value for a in assets],
+            [a.useful_life for a in assets],
+            [a.period for a in assets],
+            [a.computation for a in assets],
+            [a.capitalization_date for a in assets],
+        )
+        for asset, value in zip(assets, nbv):
+            with self.subTest(method=asset.depreciation_method, computation=asset.computation):
+                self.assertAlmostEqual(value, asset.calculate_current_nbv(), delta=0.011)
+
+
+    def test_forecast_matches_calculate_current_nbv(self):
+        assets = self.random_assets(200)
+        start = date(2025, 1, 31)
+        period_ends = get_forecast_period_ends(start, 14)
+        self.assertEqual(period_ends[0], date(2025, 2, 28))
+        self.assertEqual(period_ends[-1], date(2026, 3, 31))
+
+        accumulated, charge, nbv = portfolio_forecast(
+            [a.depreciation_method for a in assets],
+            [a.total_amount for a in assets],
+            [a.residual_value for a in assets],
+            [a.useful_life for a in assets],
+            [a.period for a in assets],
+            [a.computation for a in assets],
+            [a.capitalization_date for a in assets],
+            period_ends,
+            start,
+        )
+        self.assertEqual(nbv.shape, (len(period_ends), len(assets)))
+
+        opening, _ = portfolio_depreciation(
+            [a.depreciation_method for a in assets],
+            [a.total_amount for a in assets],
+            [a.residual_value for a in assets],
+            [a.useful_life for a in assets],
+            [a.period for a in assets],
+            [a.computation for a in assets],
+            [a.capitalization_date for a in assets],
+            start,
+        )
+        for row, period_end in enumerate(period_ends):
+            previous = accumulated[row - 1] if row else opening
+            for column, asset in enumerate(assets):
+                with self.subTest(period_end=period_end, method=asset.depreciation_method):
+                    self.assertAlmostEqual(
+                        nbv[row, column], asset.calculate_current_nbv(period_end), delta=0.011
+                    )
+                    self.assertAlmostEqual(
+                        charge[row, column], accumulated[row, column] - previous[column], delta=0.001
+                    )
+
+
+class DepreciationCalculationBatchTest(SimpleTestCase):
+    def setUp(self):
+        # Requests without a convention use the system default.
+        patcher = mock.patch.object(
+            policy_resolver, 'default_convention', return_value=compile_convention(HALF_YEAR_CONVENTION)
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, data):
+        request = APIRequestFactory().post('/api/depreciation/calculate/', data, format='json')
+        return DepreciationCalculationAPI.as_view()(request)
+
+    def test_batch_matches_single_requests(self):
+        items = [
+            {
+                "depreciation_method": method,
+                "total_amount": 120000,
+                "residual_value": 12000,
+                "useful_life": 5,
+                "period": "YEAR",
+                "computaion": computation,
+                "capitalization_date": "2022-03-15",
+            }
+            for method, computation in product(
+                ['Straight Line', 'Reducing Balance', 'Double Declining'], ['DAY', 'MONTH', 'YEAR']
+            )
+        ]
+
+        response = self.post(items)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), len(items))
+        for item, result in zip(items, response.data["results"]):
+            self.assertEqual(result, self.post(item).data)
+
+    def test_batch_reports_item_errors(self):
+        response = self.post([{"depreciation_method": "Straight Line", "capitalization_date": "bad"}])
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("error", response.data["results"][0])
+
+
+class IncrementalDepreciationTest(SimpleTestCase):
+    def test_carries_posted_nbv_forward(self):
+        today = date.today()
+        capitalization_date = today - timedelta(days=2000)
+        seed_date = today - timedelta(days=400)
+        total, residual = Decimal("250000"), Decimal("10000")
+
+        for method, computation in product(
+            ['Straight Line', 'Reducing Balance', 'Double Declining'], ['DAY', 'MONTH', 'YEAR']
+        ):
+            total_units = get_total_units(10, 'YEAR', computation)
+            seed_units = min(get_elapsed_units(capitalization_date, computation, as_of=seed_date), total_units)
+            if method == 'Straight Line':
+                seed_accumulated = straight_line(total, residual, total_units, seed_units)
+            elif method == 'Reducing Balance':
+                seed_accumulated = reducing_balance(total, residual, 10, seed_units, computation)
+            else:
+                seed_accumulated = double_declining(total, residual, 10, seed_units, computation)
+
+            accumulated, nbv = incremental_depreciation(
+                method, total, residual, 10, 'YEAR', computation, capitalization_date,
+                seed_date, total - seed_accumulated, seed_accumulated,
+            )
+            expected = calculate_depreciation(
+                method, total, residual, 10, 'YEAR', computation, capitalization_date
+            )
+            with self.subTest(method=method, computation=computation):
+                self.assertAlmostEqual(nbv, expected["current_nbv"], delta=Decimal("0.01"))
+                self.assertEqual(accumulated + nbv, total)
+
+
+class AsOfDepreciationTest(SimpleTestCase):
+    def test_as_of_pins_results(self):
+        asset = FixedAssetRegister(
+            asset_status='Ready to Use', depreciation_method='Double Declining',
+            total_amount=50000, residual_value=5000, useful_life=8, period='YEAR',
+            computation='MONTH', capitalization_date=datetime(2019, 5, 31),
+        )
+        as_of = date(2023, 2, 28)
+        self.assertEqual(asset.get_elasped_units(as_of), get_elapsed_units(asset.capitalization_date, 'MONTH', as_of))
+        self.assertEqual(asset.get_elasped_units(as_of), 45)
+
+        expected = calculate_depreciation(
+            'Double Declining', Decimal("50000"), Decimal("5000"), 8, 'YEAR', 'MONTH',
+            asset.capitalization_date, as_of,
+        )
+        self.assertEqual(float(expected["current_nbv"]), asset.calculate_current_nbv(as_of))
+
+    def test_cached_depreciation(self):
+        args = ('Straight Line', Decimal("1200"), Decimal("0"), 1, 'YEAR', 'MONTH', date(2024, 1, 1))
+        as_of = date(2024, 7, 1)
+        _cached_depreciation.cache_clear()
+
+        first = cached_depreciation(*args, as_of=as_of)
+        first["current_nbv"] = None
+        second = cached_depreciation(*args, as_of=datetime(2024, 7, 1, 9, 30))
+
+        self.assertEqual(second, calculate_depreciation(*args, as_of=as_of))
+        self.assertEqual(second["accumulated_depreciation"], Decimal("600.00"))
+        self.assertEqual(_cached_depreciation.cache_info().hits, 1)
+
+
+class DepreciationScheduleTest(SimpleTestCase):
+    def test_schedule_matches_calculate_current_nbv(self):
+        for method, computation in product(
+            ['Straight Line', 'Reducing Balance', 'Double Declining'], ['MONTH', 'YEAR']
+        ):
+            asset = FixedAssetRegister(
+                asset_status='Ready to Use', depreciation_method=method,
+                total_amount=84000, residual_value=4000, useful_life=6, period='YEAR',
+                computation=computation, capitalization_date=datetime(2021, 8, 31),
+            )
+            schedule = asset.build_depreciation_schedule()
+            self.assertEqual(len(schedule), asset.get_total_depreciation_units())
+            self.assertAlmostEqual(sum(row.charge for row in schedule), schedule[-1].accumulated, places=6)
+
+            for row in schedule:
+                with self.subTest(method=method, computation=computation, period=row.period_index):
+                    self.assertEqual(row.nbv, asset.calculate_current_nbv(row.period_end))
+                    self.assertEqual(
+                        asset.get_elasped_units(row.period_end - timedelta(days=1)), row.period_index - 1
+                    )
+
+
+    def test_day_assets_keep_monthly_rows(self):
+        asset = FixedAssetRegister(
+            asset_status='Ready to Use', depreciation_method='Reducing Balance',
+            total_amount=84000, residual_value=4000, useful_life=40, period='YEAR',
+            computation='DAY', capitalization_date=datetime(2021, 8, 17),
+        )
+        for convention in (None, compile_convention(EXACT_DATE_CONVENTION)):
+            schedule = asset.build_depreciation_schedule(convention)
+            self.assertLessEqual(len(schedule), 40 * 12 + 1)
+            self.assertEqual(schedule[0].period_end, date(2021, 9, 1))
+            for row in schedule[:-1]:
+                with self.subTest(convention=convention, period=row.period_index):
+                    self.assertEqual(row.period_end.day, 1)
+                    self.assertEqual(row.nbv, asset.calculate_current_nbv(row.period_end, convention))
+
+
+class BenchmarkSuiteTest(SimpleTestCase):
+    def test_every_benchmark_runs(self):
+        results = run_benchmarks(sample_size=20, min_time=0)
+        self.assertIn('calculate_current_nbv', results)
+        self.assertIn('lease_amortization_schedule', results)
+        for name, ops_per_sec in results.items():
+            with self.subTest(name=name):
+                self.assertGreater(ops_per_sec, 0)
+
+    def test_find_regressions(self):
+        baseline = {'straight_line': 1000.0, 'reducing_balance': 1000.0}
+        results = {'straight_line': 850.0, 'reducing_balance': 750.0, 'double_declining': 10.0}
+        self.assertEqual(find_regressions(results, baseline, 0.2), {'reducing_balance': (1000.0, 750.0)})
+
+    def test_baseline_covers_every_benchmark(self):
+        with open(BASELINE_PATH) as f:
+            baseline = json.load(f)
+        self.assertEqual(set(baseline), set(build_cases(sample_size=1)))
+
+
+class FloatBackendTest(SimpleTestCase):
+    def test_float_backend_stays_within_a_cent(self):
+        rng = random.Random(7)
+        for _ in range(3000):
+            amount = round(10 ** rng.uniform(2, 10), 2)
+            residual = round(amount * rng.choice([0.01, 0.05, 0.1, 0.3]), 2)
+            life = rng.randint(1, 50)
+            computation = rng.choice(list(UNITS_PER_YEAR))
+            total_units = life * UNITS_PER_YEAR[computation]
+            elapsed = rng.randint(0, total_units)
+            case = (amount, residual, life, elapsed, computation)
+
+            with self.subTest(case=case):
+                for exact, fast in [
+                    (reducing_balance, reducing_balance_float),
+                    (double_declining, double_declining_float),
+                ]:
+                    self.assertLessEqual(
+                        abs(exact(*case) - Decimal(str(fast(*case)))), FLOAT_MAX_DIVERGENCE
+                    )
+                self.assertLessEqual(
+                    abs(straight_line(Decimal(str(amount)), Decimal(str(residual)), total_units, elapsed)
+                        - Decimal(str(straight_line_float(amount, residual, total_units, elapsed)))),
+                    FLOAT_MAX_DIVERGENCE,
+                )
+
+    def test_calculate_depreciation_float_backend(self):
+        args = ('Reducing Balance', Decimal("90000"), Decimal("9000"), 7, 'YEAR', 'MONTH', date(2020, 6, 15))
+        as_of = date(2024, 1, 1)
+        exact = calculate_depreciation(*args, as_of=as_of)
+        fast = calculate_depreciation(*args, as_of=as_of, backend=FLOAT_BACKEND)
+        self.assertIsInstance(fast["current_nbv"], float)
+        self.assertEqual(fast["elapsed_units"], exact["elapsed_units"])
+        self.assertLessEqual(abs(exact["current_nbv"] - Decimal(str(fast["current_nbv"]))), FLOAT_MAX_DIVERGENCE)
+
+
+class ProrationConventionTest(SimpleTestCase):
+    conventions = list(CONVENTION_RULES)
+
+    def test_weight_tables(self):
+        acquired = date(2024, 3, 15)
+        self.assertEqual(compile_convention(HALF_YEAR_CONVENTION).weight('acquisition', acquired, 'YEAR'), Decimal("0.5"))
+        self.assertEqual(
+            compile_convention(MONTHLY_PRORATA_CONVENTION).weight('acquisition', acquired, 'YEAR'),
+            Decimal(10) / Decimal(12),
+        )
+        self.assertEqual(
+            compile_convention(EXACT_DATE_CONVENTION).weight('acquisition', acquired, 'YEAR'),
+            Decimal(292) / Decimal(366),
+        )
+        self.assertEqual(
+            compile_convention(EXACT_DATE_CONVENTION).weight('disposal', date(2023, 2, 15), 'MONTH'),
+            Decimal(14) / Decimal(28),
+        )
+        self.assertEqual(
+            compile_convention(HALF_YEAR_CONVENTION, full_depre_in_acquisition_yr=True).weight('acquisition', acquired, 'YEAR'),
+            Decimal("1"),
+        )
+
+    def test_straight_line_half_year(self):
+        asset = FixedAssetRegister(
+            asset_status='Ready to Use', depreciation_method='Straight Line',
+            total_amount=10000, residual_value=0, useful_life=5, period='YEAR',
+            computation='YEAR', capitalization_date=datetime(2021, 10, 1),
+        )
+        convention = compile_convention(HALF_YEAR_CONVENTION)
+        self.assertEqual(asset.calculate_current_nbv(date(2021, 12, 31), convention), 10000)
+        self.assertEqual(asset.calculate_current_nbv(date(2022, 1, 1), convention), 9000)
+        self.assertEqual(asset.calculate_current_nbv(date(2023, 1, 1), convention), 7000)
+        self.assertEqual(asset.calculate_current_nbv(date(2027, 1, 1), convention), 0)
+
+        schedule = asset.build_depreciation_schedule(convention)
+        self.assertEqual([row.charge for row in schedule], [1000, 2000, 2000, 2000, 2000, 1000])
+        self.assertEqual(schedule[0].period_end, date(2022, 1, 1))
+
+    def test_half_year_weighs_the_calendar_year(self):
+        table = compile_convention(HALF_YEAR_CONVENTION)
+        acquired = date(2024, 3, 15)
+        self.assertEqual(prorated_units(table, acquired, 'MONTH', 60, date(2025, 1, 1)), (Decimal(6), Decimal(6)))
+        self.assertEqual(prorated_units(table, acquired, 'MONTH', 60, date(2024, 8, 1))[0], Decimal(3))
+        self.assertEqual(prorated_units(table, acquired, 'MONTH', 60, date(2025, 4, 1))[0], Decimal(9))
+        self.assertEqual(
+            prorated_units(table, acquired, 'MONTH', 60, date(2027, 1, 1), disposal_date=date(2026, 9, 30))[0],
+            Decimal(24),
+        )
+        self.assertEqual(prorated_units(table, acquired, 'DAY', 1825, date(2025, 1, 1))[0], Decimal(183))
+
+    def test_arrays_match_scalar(self):
+        rng = random.Random(11)
+        starts = [date(2020, 1, 1) + timedelta(days=rng.randint(0, 1500)) for _ in range(300)]
+        computations = [rng.choice(['DAY', 'MONTH', 'YEAR']) for _ in starts]
+        disposals = [start + timedelta(days=rng.randint(0, 900)) if rng.random() < 0.3 else None for start in starts]
+        as_of = date(2023, 6, 17)
+        for name in self.conventions:
+            table = compile_convention(name)
+            units, first = prorated_units_array(table, starts, computations, [40] * len(starts), as_of, disposals)
+            for index, start in enumerate(starts):
+                with self.subTest(convention=name, start=start, computation=computations[index]):
+                    expected_units, expected_first = prorated_units(
+                        table, start, computations[index], 40, as_of, disposals[index]
+                    )
+                    self.assertAlmostEqual(units[index], float(expected_units), places=9)
+                    self.assertAlmostEqual(first[index], float(expected_first), places=9)
+
+    def test_portfolio_matches_calculate_current_nbv(self):
+        assets = PortfolioDepreciationTest().random_assets(300)
+        as_of = date(2026, 3, 9)
+        for name in self.conventions:
+            convention = compile_convention(name)
+            accumulated, nbv = portfolio_depreciation(
+                [a.depreciation_method for a in assets],
+                [a.total_amount for a in assets],
+                [a.residual_value for a in assets],
+                [a.useful_life for a in assets],
+                [a.period for a in assets],
+                [a.computation for a in assets],
+                [a.capitalization_date for a in assets],
+                as_of,
+                convention,
+            )
+            for asset, value in zip(assets, nbv):
+                with self.subTest(convention=name, method=asset.depreciation_method, computation=asset.computation):
+                    self.assertAlmostEqual(value, asset.calculate_current_nbv(as_of, convention), delta=0.011)
+
+    def test_backends_agree(self):
+        for name, method in product(self.conventions, ['Straight Line', 'Reducing Balance', 'Double Declining']):
+            args = (method, Decimal("90000"), Decimal("9000"), 7, 'YEAR', 'MONTH', date(2020, 6, 15))
+            convention = compile_convention(name)
+            exact = calculate_depreciation(*args, as_of=date(2024, 1, 20), convention=convention)
+            fast = calculate_depreciation(*args, as_of=date(2024, 1, 20), backend=FLOAT_BACKEND, convention=convention)
+            with self.subTest(convention=name, method=method):
+                self.assertEqual(exact["elapsed_units"], fast["elapsed_units"])
+                self.assertLessEqual(
+                    abs(exact["current_nbv"] - Decimal(str(fast["current_nbv"]))), FLOAT_MAX_DIVERGENCE
+                )
+
+    def test_full_rate_in_the_first_year(self):
+        # Reducing Balance to a zero residual and Double Declining over two
+        # years both depreciate at a yearly rate of 1.
+        acquired = date(2024, 3, 15)
+        cases = [('Reducing Balance', Decimal("0"), 5), ('Double Declining', Decimal("0"), 2)]
+        for name, (method, residual, life) in product(self.conventions, cases):
+            convention = compile_convention(name)
+            args = (method, Decimal("12000"), residual, life, 'YEAR', 'YEAR', acquired)
+            for as_of in [date(2024, 3, 15), date(2024, 9, 30), date(2025, 1, 1), date(2025, 9, 30), date(2027, 1, 1)]:
+                with self.subTest(convention=name, method=method, as_of=as_of):
+                    exact = calculate_depreciation(*args, as_of=as_of, convention=convention)
+                    fast = calculate_depreciation(*args, as_of=as_of, backend=FLOAT_BACKEND, convention=convention)
+                    self.assertLessEqual(
+                        abs(exact["current_nbv"] - Decimal(str(fast["current_nbv"]))), FLOAT_MAX_DIVERGENCE
+                    )
+                    self.assertGreaterEqual(exact["current_nbv"], residual)
+
+                    asset = FixedAssetRegister(
+                        asset_status='Ready to Use', depreciation_method=method, total_amount=12000,
+                        residual_value=residual, useful_life=life, period='YEAR', computation='YEAR',
+                        capitalization_date=datetime(2024, 3, 15),
+                    )
+                    self.assertAlmostEqual(
+                        float(asset.calculate_current_nbv(as_of, convention)), float(exact["current_nbv"]), delta=0.011
+                    )
+
+                    accumulated, nbv = incremental_depreciation(
+                        *args, date(2024, 6, 30), Decimal("12000"), Decimal("0"), as_of=as_of,
+                        convention=convention,
+                    )
+                    self.assertGreaterEqual(nbv, residual)
+
+
+class MultiBookPolicyTest(SimpleTestCase):
+    def test_category_policy_overrides(self):
+        policy = AssetCategoryPolicy(
+            useful_life=3, period='Year', method='Double Declining Method', residual_value=Decimal("250.00"),
+            use_book_default=False, allow_residual_override=True,
+            override_convention_for_category=True, half_yr=True,
+        )
+        self.assertEqual(policy.get_register_overrides(), {
+            'depreciation_method': 'Double Declining', 'useful_life': 3, 'period': 'YEAR',
+        })
+        self.assertIs(policy.get_proration_table(), compile_convention(HALF_YEAR_CONVENTION))
+
+        policy.use_book_default = True
+        self.assertEqual(policy.get_register_overrides(), {})
+
+    def test_book_convention(self):
+        book_policy = BookLevelPolicy(depreciation_convention=MONTHLY_PRORATA_CONVENTION)
+        self.assertIs(book_policy.get_proration_table(), compile_convention(MONTHLY_PRORATA_CONVENTION))
+        self.assertIsNone(BookLevelPolicy(depreciation_convention='').get_proration_table())
+
+
+class MultiBookCategoryTest(SimpleTestCase):
+    def test_category_follows_the_account(self):
+        rows = [
+            (1, 'Ready to Use', 'MV-01', 'Motor Vehicles', 'Straight Line', 12000, 0, 5, 'YEAR', 'MONTH',
+             datetime(2023, 1, 1)),
+            (2, 'Ready to Use', 'FF-01', 'Renamed Furniture', 'Straight Line', 6000, 0, 5, 'YEAR', 'MONTH',
+             datetime(2023, 1, 1)),
+            (3, 'Ready to Use', 'XX-99', 'Office Equipment', 'Straight Line', 3000, 0, 5, 'YEAR', 'MONTH',
+             datetime(2023, 1, 1)),
+        ]
+        queryset = mock.Mock()
+        queryset.order_by.return_value.values_list.return_value = rows
+        categories = {'MV-01': 7, 'FF-01': 8, 'Office Equipment': 9}
+        book = mock.Mock(book_name='Tax', book_level='Tax', overrides=(), convention=None)
+
+        with mock.patch.object(portfolio.policy_resolver, 'book_ids', return_value=[1]), \
+                mock.patch.object(portfolio.policy_resolver, 'category_for', side_effect=categories.get), \
+                mock.patch.object(portfolio.policy_resolver, 'resolve', return_value=book):
+            results = portfolio.calculate_multi_book_depreciation(queryset, date(2025, 1, 1))
+
+        self.assertEqual([row['category_id'] for row in results], [7, 8, 9])
+
+        categories.pop('Office Equipment')
+        with mock.patch.object(portfolio.policy_resolver, 'book_ids', return_value=[1]), \
+                mock.patch.object(portfolio.policy_resolver, 'category_for', side_effect=categories.get), \
+                mock.patch.object(portfolio.policy_resolver, 'resolve', return_value=book):
+            results = portfolio.calculate_multi_book_depreciation(queryset, date(2025, 1, 1))
+
+        self.assertIsNone(results[2]['category_id'])
+        self.assertEqual(results[2]['current_nbv'], 1800.0)
+
+
+class PolicyResolverTest(SimpleTestCase):
+    def test_resolution_precedence(self):
+        system_default = SystemDefault(
+            depreciation_frequency='Monthly', posting_date_rule='End of Month', rounding_precision=Decimal("0.01"),
+            depreciation_start_rule='From Capitalization Date', depreciation_convention=HALF_YEAR_CONVENTION,
+        )
+        book_policy = BookLevelPolicy(
+            book=AssetBook(book_id=7, book_name='Tax'), default=system_default, book_level='Tax',
+            posting_date_rule='Last Working Day', depreciation_start_rule='',
+            depreciation_convention=MONTHLY_PRORATA_CONVENTION,
+        )
+        resolved = _resolve(book_policy)
+        self.assertEqual(resolved.book_id, 7)
+        self.assertEqual(resolved.depreciation_frequency, 'Monthly')
+        self.assertEqual(resolved.posting_date_rule, 'Last Working Day')
+        self.assertEqual(resolved.depreciation_start_rule, 'From Capitalization Date')
+        self.assertEqual(resolved.rounding_precision, Decimal("0.01"))
+        self.assertIs(resolved.convention, compile_convention(MONTHLY_PRORATA_CONVENTION))
+        self.assertEqual(resolved.overrides, ())
+
+        category_policy = AssetCategoryPolicy(
+            book_level_policy=book_policy, category_id=3, depreciation_frequency='Annually',
+            useful_life=4, period='Month', method='Straight Line Method', residual_value=Decimal("0"),
+            use_book_default=False, allow_method_override=True, allow_residual_override=True,
+        )
+        resolved = _resolve(book_policy, category_policy)
+        self.assertEqual(resolved.category_id, 3)
+        self.assertEqual(resolved.depreciation_frequency, 'Annually')
+        self.assertEqual(resolved.overrides, (('period', 'MONTH'), ('useful_life', 4)))
+        self.assertIs(resolved.convention, compile_convention(MONTHLY_PRORATA_CONVENTION))
+        with self.assertRaises(AttributeError):
+            resolved.convention = None
+
+    def test_signals_clear_the_cache(self):
+        policy_resolver._loaded_at = 0.0
+        post_save.send(sender=Category, instance=Category(), created=False)
+        self.assertIsNone(policy_resolver._loaded_at)
+
+
+class DirtyFieldTrackingTest(SimpleTestCase):
+    def loaded_asset(self):
+        asset = FixedAssetRegister(
+            register_id=1, asset_status='Ready to Use', depreciation_method='Straight Line',
+            exchange_rate=1, acquisition_cost=1000, transportation_fee=0, tax=0, other_fee=0,
+            total_amount=1000, residual_value=100, useful_life=5, period='YEAR', computation='MONTH',
+            capitalization_date=datetime(2022, 1, 1), description='',
+        )
+        field_names = [field.attname for field in FixedAssetRegister._meta.concrete_fields]
+        return FixedAssetRegister.from_db('default', field_names, [getattr(asset, name) for name in field_names])
+
+    def test_new_instances_are_fully_dirty(self):
+        self.assertEqual(FixedAssetRegister().get_dirty_fields(), set(FixedAssetRegister.TRACKED_FIELDS))
+
+    def test_only_depreciation_inputs_are_dirty(self):
+        asset = self.loaded_asset()
+        self.assertEqual(asset.get_dirty_fields(), set())
+
+        asset.description = 'Relabelled'
+        asset.asset_status = 'Finished'
+        self.assertEqual(asset.get_dirty_fields(), set())
+
+        asset.asset_status = 'No Depreciation'
+        asset.acquisition_cost = 1200
+        self.assertEqual(asset.get_dirty_fields(), {'asset_status', 'acquisition_cost'})
+
+
+class RefreshCheckpointTest(SimpleTestCase):
+    def test_checkpoint_round_trip(self):
+        command = RefreshCurrentNbvCommand()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'checkpoint')
+            self.assertIsNone(command.read_checkpoint(path, date(2025, 1, 31)))
+
+            command.write_checkpoint(path, {'as_of': '2025-01-31', 'last_id': 42, 'scanned': 42, 'updated': 7})
+            self.assertEqual(command.read_checkpoint(path, date(2025, 1, 31))['last_id'], 42)
+            self.assertIsNone(command.read_checkpoint(path, date(2025, 2, 1)))
+
+
+class DepreciationPreviewStreamTest(SimpleTestCase):
+    rows = [
+        {'register_id': 1, 'fixed_asset_code': 'FA-1', 'old_nbv': Decimal('1000.00'), 'new_nbv': Decimal('900.00'),
+         'depreciation_amount': Decimal('100.00'), 'new_status': 'Ready to Use'},
+        {'register_id': 2, 'fixed_asset_code': 'FA-2', 'skipped_reason': 'No asset policy'},
+    ]
+
+    def test_ndjson_emits_one_object_per_line(self):
+        lines = list(stream_depreciation_preview(iter(self.rows)))
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(all(line.endswith('\n') for line in lines))
+        self.assertEqual(json.loads(lines[0])['depreciation_amount'], '100.00')
+        self.assertEqual(json.loads(lines[1])['skipped_reason'], 'No asset policy')
+
+    def test_csv_writes_header_then_rows(self):
+        lines = list(stream_depreciation_preview(iter(self.rows), 'csv'))
+        parsed = list(csv.DictReader(lines))
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(list(parsed[0]), DEPRECIATION_PREVIEW_COLUMNS)
+        self.assertEqual(parsed[0]['new_nbv'], '900.00')
+        self.assertEqual(parsed[1]['new_nbv'], '')
+
+
+class PeriodEndDepreciationFlagsTest(SimpleTestCase):
+    def post(self, data, format=None):
+        request = APIRequestFactory().post('/execute-depreciation/period-end/', data, format=format)
+        with mock.patch.object(views, 'run_period_depreciation', return_value=_new_run_report()) as run, \
+                mock.patch.object(views, 'preview_period_depreciation') as preview:
+            response = PeriodEndDepreciationAPI.as_view()(request)
+        return response, run, preview
+
+    def test_string_flags_are_parsed(self):
+        for data, format in [
+            ({'dry_run': 'false', 'incremental': '0', 'show_in_journal': 'False'}, None),
+            ({'dry_run': 'false', 'incremental': 'false'}, 'json'),
+        ]:
+            with self.subTest(data=data, format=format):
+                response, run, preview = self.post(data, format)
+                self.assertEqual(response.status_code, 201)
+                preview.assert_not_called()
+                self.assertFalse(run.call_args.kwargs['incremental'])
+                self.assertFalse(run.call_args.kwargs['show_in_journal'])
+
+        response, run, preview = self.post({'dry_run': 'true', 'incremental': '1'})
+        self.assertEqual(response.status_code, 200)
+        run.assert_not_called()
+        self.assertTrue(preview.call_args.kwargs['incremental'])
+
+    def test_unreadable_flags_are_rejected(self):
+        response, run, preview = self.post({'dry_run': 'maybe'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('dry_run', response.data)
+        run.assert_not_called()
+
+
+class DepreciationPartitionTest(SimpleTestCase):
+    def partitions(self, register_ids, partitions):
+        with mock.patch.object(depreciation_runs.FixedAssetRegister, 'objects') as objects:
+            queryset = objects.filter.return_value.order_by.return_value
+            queryset.values_list.return_value = register_ids
+            return get_depreciation_partitions('range', partitions)
+
+    def test_ranges_cover_every_register_once(self):
+        register_ids = [3, 4, 8, 9, 15, 16, 23, 42, 43, 50]
+        ranges = self.partitions(register_ids, 4)
+        self.assertEqual(ranges, [
+            {'register_id__gte': 3, 'register_id__lte': 8},
+            {'register_id__gte': 9, 'register_id__lte': 16},
+            {'register_id__gte': 23, 'register_id__lte': 43},
+            {'register_id__gte': 50, 'register_id__lte': 50},
+        ])
+
+    def test_partitions_never_outnumber_registers(self):
+        self.assertEqual(self.partitions([7, 11], 8), [
+            {'register_id__gte': 7, 'register_id__lte': 7},
+            {'register_id__gte': 11, 'register_id__lte': 11},
+        ])
+        self.assertEqual(self.partitions([], 4), [])
+
+    def test_unknown_partitioning_is_rejected(self):
+        with mock.patch.object(depreciation_runs.FixedAssetRegister, 'objects'):
+            with self.assertRaises(ValueError):
+                get_depreciation_partitions('category', 4)
+
+
+class DepreciationRunReportTest(SimpleTestCase):
+    def test_merge_adds_counts_and_keeps_skips(self):
+        report = _new_run_report()
+        _merge_run_report(report, {'processed': 3, 'finished': 1, 'total_depreciation': 100.105,
+                                   'skipped': [{'register_id': 1, 'reason': 'No asset policy'}]})
+        _merge_run_report(report, {'processed': 2, 'finished': 0, 'total_depreciation': 0.2, 'skipped': []})
+        self.assertEqual(report['processed'], 5)
+        self.assertEqual(report['finished'], 1)
+        self.assertEqual(report['total_depreciation'], 100.31)
+        self.assertEqual(report['skipped'], [{'register_id': 1, 'reason': 'No asset policy'}])
+
+    def test_assets_without_a_policy_are_skipped(self):
+        assets = [FixedAssetRegister(register_id=1, fixed_asset_code='FA-1'),
+                  FixedAssetRegister(register_id=2, fixed_asset_code='FA-2')]
+        with mock.patch.object(depreciation_runs, '_policies_by_register', return_value={}), \
+                mock.patch.object(depreciation_runs, '_latest_events_by_register') as latest_events, \
+                mock.patch.object(depreciation_runs, '_bulk_create_depreciations') as bulk_create:
+            report = _post_depreciation_chunk(assets, None, date(2025, 1, 31))
+
+        self.assertEqual(report['processed'], 0)
+        self.assertEqual(report['total_depreciation'], 0.0)
+        self.assertEqual(report['skipped'], [
+            {'register_id': 1, 'reason': 'No asset policy'},
+            {'register_id': 2, 'reason': 'No asset policy'},
+        ])
+        latest_events.assert_not_called()
+        bulk_create.assert_not_called()
+
+
+class DepreciationRunStorageTest(TestCase):
+    def setUp(self):
+        company = Company.objects.create(company_code='C1', company_name='Company')
+        department = Department.objects.create(company=company, dept_code='D1', dept_name='Finance')
+        self.account = Account.objects.create(account_code='1500', account_name='Machinery', account_type='Asset',
+                                              currency='USD')
+        self.user = Users.objects.create(name='Closer', email='closer@example.com')
+        self.assets = [
+            self.create_asset(f'FA-{index}', method)
+            for index, method in enumerate(['Straight Line', 'Reducing Balance', 'Double Declining'] * 2)
+        ]
+        seed = Depreciation.objects.create(
+            register=self.assets[0], account=self.account, depreciation_date=date(2023, 1, 1), method='Straight Line',
+            computation='MONTH', book_value=0, depreciation_rate=0,
+        )
+        for asset in self.assets[:-1]:
+            AssetPolicy.objects.create(
+                register=asset, company=company, department=department, depreciation=seed, useful_life=5,
+                period='YEAR', status='Active', start_date=datetime(2023, 1, 1), end_date=datetime(2028, 1, 1),
+                method=asset.depreciation_method, amount=0,
+            )
+
+    def create_asset(self, code, method):
+        asset = FixedAssetRegister.objects.create(
+            account=self.account, fixed_asset_code=code, fixed_asset_account='Machinery',
+            acquisition_date=date(2023, 1, 1), source_type='DIRECT', asset_status='Ready to Use', asset_name=code,
+            asset_type='MAIN', useful_life=5, period='YEAR', capitalization_date=datetime(2023, 1, 1),
+            transaction_currency='USD', exchange_rate=1, acquisition_cost=60000, home_acquisition_cost=0,
+            residual_value=6000, transportation_fee=0, tax=0, other_fee=0, total_amount=0, computation='MONTH',
+            addition_amount=0, depreciation_method=method, current_nbv=0, depreciation_account='Depreciation',
+            expense_account='Expense', supplier='Supplier',
+        )
+        FixedAssetRegister.objects.filter(pk=asset.pk).update(current_nbv=asset.total_amount)
+        return asset
+
+    def test_run_posts_each_asset_once(self):
+        run_date = date(2024, 12, 31)
+        report = run_period_depreciation(self.user.pk, run_date, chunk_size=2)
+
+        self.assertEqual(report['chunks'], 3)
+        self.assertEqual(report['processed'], 5)
+        self.assertEqual(report['skipped'], [{'register_id': self.assets[-1].pk, 'reason': 'No asset policy'}])
+        self.assertEqual(Depreciation.objects.filter(depreciation_date=run_date).count(), 5)
+        self.assertEqual(DepreciationAuditLog.objects.count(), 5)
+        for event in DepreciationEvent.objects.select_related('register', 'depreciation'):
+            with self.subTest(register_id=event.register_id):
+                self.assertEqual(event.depreciation.register_id, event.register_id)
+                self.assertEqual(event.register.current_nbv, event.nbv_depreciation)
+                self.assertEqual(
+                    event.nbv_depreciation, event.register.calculate_current_nbv(run_date, None)
+                )
+        self.assertAlmostEqual(
+            report['total_depreciation'],
+            float(sum(event.depreciation_amount for event in DepreciationEvent.objects.all())),
+            places=2,
+        )
+
+        rerun = run_period_depreciation(self.user.pk, run_date, chunk_size=2)
+        self.assertEqual(rerun['processed'], 0)
+        self.assertEqual(len(rerun['skipped']), 6)
+        self.assertEqual(DepreciationEvent.objects.count(), 5)
+
+        later = run_period_depreciation(self.user.pk, date(2025, 1, 31), chunk_size=2)
+        self.assertEqual(later['processed'], 5)
+        latest = DepreciationEvent.objects.filter(depreciation_date=date(2025, 1, 31))
+        for event in latest:
+            previous = DepreciationEvent.objects.get(register=event.register, depreciation_date=run_date)
+            self.assertEqual(event.depreciation_amount, round(previous.nbv_depreciation - event.nbv_depreciation, 2))
+
+    def test_refresh_resumes_from_the_checkpoint(self):
+        as_of = date(2024, 6, 30)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'checkpoint')
+            with open(path, 'w') as f:
+                json.dump({'as_of': as_of.isoformat(), 'last_id': self.assets[1].pk, 'scanned': 2, 'updated': 2}, f)
+
+            call_command('refresh_current_nbv', date=as_of.isoformat(), chunk_size=2, checkpoint=path,
+                         stdout=open(os.devnull, 'w'))
+            self.assertFalse(os.path.exists(path))
+
+        stored = dict(FixedAssetRegister.objects.values_list('pk', 'current_nbv'))
+        for asset in self.assets[:2]:
+            self.assertEqual(stored[asset.pk], asset.total_amount)
+        for asset in self.assets[2:]:
+            self.assertEqual(stored[asset.pk], asset.calculate_current_nbv(as_of))
+
+        pages = list(refresh_current_nbv(as_of, chunk_size=4))
+        self.assertEqual(pages[-1], (self.assets[-1].pk, 6, 2))
+        self.assertEqual(list(refresh_current_nbv(as_of, chunk_size=4))[-1], (self.assets[-1].pk, 6, 0))
+
+
+class LeaseJournalStorageTest(TestCase):
+    def test_period_is_posted_once(self):
+        leases = [create_lease(f'GL-{index}', date(2023, 1, 1)) for index in range(2)]
+        LeaseAmortizationSchedule.objects.filter(financial=leases[1]).delete()
+        LeaseRouSchedule.objects.filter(financial=leases[1]).delete()
+
+        report = post_lease_journals(date(2024, 6, 30), chunk_size=1)
+        self.assertEqual(report['regenerated'], 1)
+        self.assertEqual(report['leases'], 2)
+        self.assertEqual(report['created'], 10)
+        self.assertEqual(GeneralLedger.objects.filter(source_type='LEASE').count(), 10)
+        for lease in leases:
+            lines = GeneralLedger.objects.filter(source_id=lease.pk)
+            self.assertAlmostEqual(sum(line.debit_amount for line in lines),
+                                   sum(line.credit_amount for line in lines), places=2)
+
+        rerun = post_lease_journals(date(2024, 6, 30), chunk_size=1)
+        self.assertEqual((rerun['created'], rerun['skipped'], rerun['regenerated']), (0, 10, 0))
+        self.assertEqual(GeneralLedger.objects.filter(source_type='LEASE').count(), 10)
+
+    def test_repeated_remeasurement_records_once(self):
+        lease = create_lease('GL-RM', date(2023, 1, 1))
+        lease.changing_date = date(2024, 7, 1)
+        lease.changing_amount = Decimal('1200.00')
+        lease.save()
+        rows = list(LeaseAmortizationSchedule.objects.filter(financial=lease).order_by('period').values())
+
+        lease = LeaseFinancial.objects.get(pk=lease.pk)
+        self.assertEqual(lease.remeasure(18), lease.remeasurements.get())
+        self.assertEqual(list(LeaseAmortizationSchedule.objects.filter(financial=lease).order_by('period').values()),
+                         rows)
+
+
+class LeasePresentValueTest(SimpleTestCase):
+    def loop_pv(self, lease):
+        _, periodic_rate, total_periods, change_at_period = lease.get_payment_terms()
+        shift = 1 if lease.payment_timing == 'Advance' else 0
+        total_pv = Decimal('0.00')
+        for t in range(1, total_periods + 1):
+            payment = Decimal(str(lease.payment_frequency))
+            if change_at_period and t > change_at_period:
+                payment = Decimal(str(lease.changing_amount))
+            total_pv += payment / ((Decimal('1') + periodic_rate) ** (t - shift))
+        return (total_pv + Decimal(str(lease.down_payment))).quantize(Decimal('0.01'))
+
+    def test_matches_period_loop(self):
+        rng = random.Random(18)
+        for _ in range(300):
+            lease = _lease(rng, date(2025, 6, 30))
+            if rng.random() < 0.3:
+                lease.computation = 'Year'
+            if rng.random() < 0.1:
+                lease.discount_rate = 0.0
+            with self.subTest(term=lease.lease_term, timing=lease.payment_timing, rate=lease.discount_rate):
+                self.assertEqual(lease.get_calculated_pv(), self.loop_pv(lease))
+
+    def test_advance_shifts_one_period(self):
+        rate = Decimal('0.01')
+        arrears = annuity_present_value(Decimal('100'), rate, 1, 12)
+        self.assertEqual(annuity_present_value(Decimal('100'), rate, 1, 12, advance=True), arrears * (1 + rate))
+        self.assertEqual(annuity_present_value(Decimal('100'), rate, 5, 4), Decimal('0'))
+        self.assertEqual(annuity_present_value(Decimal('100'), Decimal('0'), 3, 12), Decimal('1000'))
+
+
+class LeaseScheduleTrackingTest(SimpleTestCase):
+    def loaded_lease(self):
+        lease = _lease(random.Random(19), date(2025, 6, 30))
+        field_names = [field.attname for field in LeaseFinancial._meta.concrete_fields]
+        return LeaseFinancial.from_db('default', field_names, [getattr(lease, name) for name in field_names])
+
+    def test_only_schedule_inputs_are_dirty(self):
+        self.assertEqual(LeaseFinancial().get_dirty_fields(), set(LeaseFinancial.SCHEDULE_FIELDS))
+
+        lease = self.loaded_lease()
+        lease.reason = 'Renewed'
+        lease.currency = 'USD'
+        self.assertEqual(lease.get_dirty_fields(), set())
+
+        lease.payment_frequency += 1
+        self.assertEqual(lease.get_dirty_fields(), {'payment_frequency'})
+
+
+class LeaseScheduleIncludeTest(SimpleTestCase):
+    def fields_for(self, query):
+        request = Request(APIRequestFactory().get('/leases-financials/', query))
+        return set(LeaseFinancialSerializer(context={'request': request}).fields)
+
+    def test_schedules_are_opt_in(self):
+        self.assertFalse({'amortization_schedule', 'rou_asset_schedule'} & self.fields_for({}))
+        self.assertIn('amortization_schedule', self.fields_for({'include': 'schedule'}))
+        self.assertNotIn('rou_asset_schedule', self.fields_for({'include': 'schedule'}))
+        self.assertTrue(
+            {'amortization_schedule', 'rou_asset_schedule'} <= self.fields_for({'include': 'schedule,rou_schedule'})
+        )
+
+
+class LeaseRollForwardTest(SimpleTestCase):
+    def test_matches_summed_schedules(self):
+        rng = random.Random(21)
+        start, end = date(2023, 4, 1), date(2024, 3, 31)
+        for _ in range(40):
+            lease = _lease(rng, date(2025, 6, 30))
+            if rng.random() < 0.3:
+                lease.computation = 'Year'
+            if rng.random() < 0.3:
+                lease.start_date = date(lease.start_date.year, 1, 31)
+            is_yearly, periodic_rate, total_periods, change_at_period = lease.get_payment_terms()
+            rollforward = lease_rollforward(
+                [lease.start_date], [12 if is_yearly else 1], [total_periods], [float(lease.present_value)],
+                [float(periodic_rate)], [float(lease.payment_frequency)], [float(lease.changing_amount)],
+                [first_changed_period(change_at_period, total_periods)],
+                [float(lease.present_value + lease.down_payment + lease.other_cost + lease.dismantling_cost)],
+                start, end, advance=[lease.payment_timing == 'Advance'],
+            )
+
+            rows = [row for row in lease.get_amortization_schedule() if start.isoformat() <= row['date'] <= end.isoformat()]
+            rou_rows = [row for row in lease.get_rou_asset_schedule() if start.isoformat() <= row['date'] <= end.isoformat()]
+            tolerance = 0.01 * (len(rows) + 1)
+            with self.subTest(start_date=lease.start_date, computation=lease.computation):
+                self.assertAlmostEqual(rollforward['payments'][0], float(sum(row['payment'] for row in rows)), places=6)
+                self.assertAlmostEqual(rollforward['interest'][0], float(sum(row['interest'] for row in rows)), delta=tolerance)
+                self.assertAlmostEqual(
+                    rollforward['rou_depreciation'][0], float(sum(row['depreciation'] for row in rou_rows)), delta=tolerance
+                )
+                self.assertAlmostEqual(
+                    rollforward['closing_liability'][0],
+                    rollforward['opening_liability'][0] + rollforward['additions'][0]
+                    + rollforward['interest'][0] - rollforward['payments'][0],
+                    places=4,
+                )
+
+
+class LeaseScheduleColumnsTest(SimpleTestCase):
+    def test_dates_keep_a_clipped_month_end(self):
+        self.assertEqual(
+            schedule_dates(date(2024, 1, 31), 1, 3), (date(2024, 2, 29), date(2024, 3, 29), date(2024, 4, 29))
+        )
+        self.assertEqual(schedule_dates(date(2024, 2, 29), 12, 2), (date(2025, 2, 28), date(2026, 2, 28)))
+
+    def test_rows_are_formatted_at_the_boundary(self):
+        columns = {
+            'period': range(1, 3),
+            'date': (date(2025, 1, 31), date(2025, 2, 28)),
+            'payment': [Decimal('100'), Decimal('100.004')],
+            'closing_balance': [Decimal('50.555'), Decimal('-0.004')],
+        }
+        self.assertEqual(schedule_rows(round_columns(columns, ('closing_balance',))), [
+            {'period': 1, 'date': '2025-01-31', 'payment': Decimal('100.00'), 'closing_balance': Decimal('50.56')},
+            {'period': 2, 'date': '2025-02-28', 'payment': Decimal('100.00'), 'closing_balance': 0},
+        ])
+
+    def test_schedules_follow_the_columns(self):
+        lease = _lease(random.Random(22), date(2025, 6, 30))
+        columns = lease.get_amortization_columns()
+        schedule = lease.get_amortization_schedule()
+        self.assertEqual(len(schedule), len(columns['period']))
+        self.assertEqual(schedule[-1]['interest'], round(columns['interest'][-1], 2))
+        self.assertEqual(len(lease.get_rou_asset_schedule()), len(lease.get_rou_asset_columns()['date']))
+
+    def test_schedules_close_at_zero(self):
+        rng = random.Random(18)
+        for _ in range(100):
+            lease = _lease(rng, date(2025, 6, 30))
+            _, periodic_rate, _, _ = lease.get_payment_terms()
+            # Unrounded, so the cent rounding of the stored value does not compound.
+            lease.present_value = runs_present_value(
+                lease.get_payment_runs(), periodic_rate, lease.payment_timing == 'Advance'
+            )
+            with self.subTest(timing=lease.payment_timing, term=lease.lease_term, rate=lease.discount_rate):
+                self.assertLess(abs(lease.get_amortization_columns()['closing_balance'][-1]), Decimal('1e-6'))
+
+        rate = Decimal('0.005')
+        payments = [Decimal('1000.00')] * 36
+        balance = annuity_present_value(payments[0], rate, 1, 36, advance=True).quantize(Decimal('0.01'))
+        columns = amortization_columns(balance, rate, payments, range(1, 37), schedule_dates(date(2025, 1, 1), 1, 36), True)
+        self.assertEqual(columns['interest'][0], (balance - payments[0]) * rate)
+        self.assertLess(abs(columns['closing_balance'][-1]), Decimal('0.01'))
+
+
+class LeaseRemeasurementTest(SimpleTestCase):
+    def test_remeasured_tail_settles_the_liability(self):
+        rate = Decimal('0.005')
+        payments = [Decimal('2500.00')] * 180
+        remeasured = annuity_present_value(payments[0], rate, 1, len(payments)).quantize(Decimal('0.01'))
+        periods = range(61, 241)
+        dates = schedule_dates(date(2025, 1, 15), 1, 180)
+
+        columns = amortization_columns(remeasured, rate, payments, periods, dates)
+        self.assertEqual(columns['opening_balance'][0], remeasured)
+        self.assertEqual(columns['interest'][0], remeasured * rate)
+        self.assertLess(abs(columns['closing_balance'][-1]), Decimal('0.01'))
+
+        rou = rou_columns(Decimal('1000.00'), periods, dates)
+        self.assertEqual(rou['closing_rou'][-1], 0)
+        self.assertEqual(sum(rou['depreciation']), Decimal('1000.00'))
+
+
+class LeaseRemeasurementStorageTest(TestCase):
+    def stored_rows(self, lease):
+        return [row.as_dict() for row in LeaseAmortizationSchedule.objects.filter(financial=lease).order_by('period')]
+
+    def test_edit_after_remeasurement_rebuilds_without_stale_records(self):
+        lease = create_lease('RM-1', date(2023, 1, 1))
+        lease.changing_date = date(2024, 7, 1)
+        lease.changing_amount = Decimal('1200.00')
+        lease.save()
+        self.assertEqual(lease.remeasurements.get().effective_period, 18)
+
+        lease = LeaseFinancial.objects.get(pk=lease.pk)
+        lease.other_cost = Decimal('500.00')
+        lease.save()
+
+        self.assertFalse(LeaseRemeasurement.objects.filter(financial=lease).exists())
+        self.assertEqual(self.stored_rows(lease), [
+            dict(row, closing_balance=Decimal(str(row['closing_balance']))) for row in lease.get_amortization_schedule()
+        ])
+
+    def test_rate_change_is_remeasured_from_the_day_it_is_made(self):
+        today = date.today()
+        lease = create_lease('RM-2', today - relativedelta(months=14), changing_date=today + relativedelta(months=10),
+                             changing_amount=Decimal('1100.00'))
+        lease.discount_rate = 8.0
+        lease.save()
+
+        remeasurement = lease.remeasurements.get()
+        self.assertEqual(remeasurement.effective_date, today)
+        self.assertEqual(remeasurement.effective_period, 14)
+
+    def test_amendment_without_changes_records_nothing(self):
+        lease = create_lease('RM-3', date(2023, 1, 1), changing_date=date(2024, 7, 1),
+                             changing_amount=Decimal('1200.00'))
+        before = self.stored_rows(lease)
+
+        contract = LeaseContract.objects.get(pk=lease.lease_id)
+        contract.status = 'Amendment'
+        contract.save()
+
+        self.assertFalse(LeaseRemeasurement.objects.filter(financial=lease).exists())
+        self.assertEqual(self.stored_rows(lease), before)
+
+
+class LeaseRollForwardStorageTest(TestCase):
+    def test_remeasured_lease_rolls_forward(self):
+        lease = create_lease('RF-1', date(2023, 1, 1))
+        lease.changing_date = date(2024, 7, 1)
+        lease.changing_amount = Decimal('1200.00')
+        lease.discount_rate = 7.5
+        lease.save()
+        self.assertTrue(lease.remeasurements.exists())
+
+        cpi = create_lease('RF-2', date(2023, 1, 1), escalation_type='CPI')
+        LeaseFinancial.objects.filter(pk=cpi.pk).update(escalation_factors=['1', '1.03', '1.05', '1.08', '1.1'])
+
+        # Leases, remeasurements, then the remeasured leases' two schedules;
+        # the pinned CPI ratios come with the leases.
+        with self.assertNumQueries(4):
+            ids, rollforward = calculate_lease_rollforward(date(2024, 1, 1), date(2024, 12, 31))
+
+        index = [financial_id for financial_id, _ in ids].index(lease.pk)
+        self.assertNotEqual(rollforward['remeasurements'][index], 0)
+        for index in range(len(ids)):
+            with self.subTest(financial_id=ids[index][0]):
+                self.assertAlmostEqual(
+                    rollforward['opening_liability'][index] + rollforward['additions'][index]
+                    + rollforward['interest'][index] - rollforward['payments'][index]
+                    + rollforward['remeasurements'][index],
+                    rollforward['closing_liability'][index],
+                    delta=0.05,
+                )
+
+
+class LeaseEscalationTest(SimpleTestCase):
+    def test_runs_escalate_by_lease_year(self):
+        runs = payment_runs(30, Decimal('1000.00'), Decimal('1500.00'), 19, percent_factors(5, 3), 12)
+        self.assertEqual(runs, (
+            (1, 12, Decimal('1000.00')),
+            (13, 18, Decimal('1050.00')),
+            (19, 24, Decimal('1575.00')),
+            (25, 30, Decimal('1653.75')),
+        ))
+        self.assertEqual(payment_runs(12, Decimal('10'), Decimal('20'), 13), ((1, 12, Decimal('10')),))
+
+    def test_present_value_follows_the_runs(self):
+        rate = Decimal('0.004')
+        runs = payment_runs(36, Decimal('1000.00'), Decimal('1000.00'), 37, percent_factors(3, 3), 12)
+        payments = expand_runs(runs)
+        for advance in (False, True):
+            expected = sum(
+                payment / (1 + rate) ** (t - advance) for t, payment in enumerate(payments, start=1)
+            )
+            self.assertAlmostEqual(runs_present_value(runs, rate, advance), expected, places=18)
+        self.assertEqual(expand_runs(runs, 30), payments[30:])
+        self.assertAlmostEqual(
+            runs_present_value(runs, rate, after=30),
+            sum(payment / (1 + rate) ** t for t, payment in enumerate(payments[30:], start=1)),
+            places=18,
+        )
+
+    def test_cpi_runs_follow_the_pinned_factors(self):
+        lease = _lease(random.Random(24), date(2025, 6, 30))
+        lease.computation, lease.lease_term, lease.changing_date = 'Month', 2, None
+        lease.escalation_type = 'CPI'
+        lease.escalation_factors = ['1', '1.1']
+        payment = lease.payment_frequency
+        self.assertEqual(lease.get_payment_runs(), (
+            (1, 12, payment), (13, 24, (payment * Decimal('1.1')).quantize(Decimal('0.01'))),
+        ))
+
+    def test_escalated_balances_match_the_step_closed_form(self):
+        runs = [payment_runs(24, Decimal('500'), Decimal('650'), 10), payment_runs(24, Decimal('80'), Decimal('80'), 25)]
+        step, _ = amortization_balances([9000.0, 1500.0], [0.01, 0.0], [500, 80], [650, 80], [10, 25], 24)
+        general = escalated_balances([9000.0, 1500.0], [0.01, 0.0], runs_matrix(runs, 24))
+        self.assertTrue(np.allclose(step, general))
+
+
+class LeaseJournalLineTest(SimpleTestCase):
+    def test_negative_amounts_switch_sides(self):
+        account = Account(account_id=1, account_code='2100', account_name='Lease Liability')
+        line = _lease_journal_line('LEASE-1-7-LIA', account, Decimal('-12.50'), True, gl_code=202406)
+        self.assertEqual((line.debit_amount, line.credit_amount), (0, 12.5))
+        self.assertEqual(line.account_code, '2100')
+
+        line = _lease_journal_line('LEASE-1-7-INT', account, Decimal('40.25'), True, gl_code=202406)
+        self.assertEqual((line.debit_amount, line.credit_amount), (40.25, 0))
+        self.assertEqual(line.posting_key, 'LEASE-1-7-INT')
@@ -16,6 +16,7 @@ router.register(r'fixed-assets', FixedAssetRegisterViewSet)
 router.register(r'asset-components', AssetComponentViewSet)
 router.register(r'depreciations', DepreciationViewSet)
 router.register(r'depreciation-events', DepreciationEventViewSet)
+router.register(r'depreciation-schedules', DepreciationScheduleViewSet)
 router.register(r'asset-policies', AssetPolicyViewSet)
 router.register(r'asset-disposals', AssetDisposalViewSet)
 router.register(r'asset-adjustments', AssetAdjustmentViewSet)
@@ -30,10 +31,12 @@ router.register(r'asset-category-policies', AssetCategoryPolicyViewSet)
 
 router.register(r'leases-contracts', LeaseContractViewSet, basename='leasecontract')
 router.register(r'leases-financials', LeaseFinancialViewSet, basename='leasefinancial')
+router.register(r'cpi-index', CPIIndexViewSet)
 
 urlpatterns = [
     path('depreciation/calculate/', DepreciationCalculationAPI.as_view(), name='depreciation-calculation'),
     path('execute-depreciation/', ExecuteDepreciationAPI.as_view(), name='execute-depreciation'),
+    path('execute-depreciation/period-end/', PeriodEndDepreciationAPI.as_view(), name='execute-period-end-depreciation'),
     path('fixed-assets/<int:pk>/full-detail/', FixedAssetFullDetailAPI.as_view(), name='fixed-asset-full-detail'),
     path('wips/<int:pk>/items/', WIPItemsAPI.as_view()),
     path('wips/<int:pk>/fixed-assets/', WIPFixedAssetAPI.as_view()),
@@ -53,6 +56,11 @@ urlpatterns = [
     path('depreciations/<int:pk>/asset-policies/',DepreciationAssetPolicyAPI.as_view()),
     path('fixed-assets/<int:pk>/depreciation-events/',FixedAssetDepreciationEventAPI.as_view()),
     path('fixed-assets/<int:pk>/depreciations/',FixedAssetDepreciationAPI.as_view()),
+    path('fixed-assets/<int:pk>/depreciation-schedule/',FixedAssetDepreciationScheduleAPI.as_view()),
+    path('fixed-assets/forecast/',PortfolioForecastAPI.as_view()),
+    path('fixed-assets/book-depreciation/',MultiBookDepreciationAPI.as_view()),
+    path('leases-financials/roll-forward/',LeaseRollForwardAPI.as_view()),
+    path('leases-financials/post-journals/',LeaseJournalPostingAPI.as_view()),
     path('fixed-assets/<int:pk>/asset-policies/',FixedAssetPolicyAPI.as_view()),
     path('fixed-assets/<int:pk>/asset-adjustments/',FixedAssetAdjustmentAPI.as_view()),
     path('fixed-assets/<int:pk>/dept-histories/',FixedAssetDeptHistoryAPI.as_view()),
@@ -10,6 +10,7 @@ from .models import *
 from django.contrib.auth.hashers import check_password
 from .serializers import *
 from django.shortcuts import get_object_or_404
+import json
 import traceback
 from rest_framework.permissions import AllowAny
 from google.oauth2 import id_token
@@ -17,13 +18,14 @@ from google.auth.transport import requests
 from django.contrib.auth.models import User
 import jwt
 import requests
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.pagination import PageNumberPagination
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from django.contrib.auth import get_user_model
 from rest_framework.permissions import IsAuthenticated
 from rest_framework_simplejwt.tokens import RefreshToken
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 import requests as http_requests
 from django.core.mail import send_mail
 from .models import PasswordResetToken
@@ -31,12 +33,18 @@ from .serializers import ForgotPasswordSerializer
 from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
 from .services.depreciation import (
-    get_total_units,
-    get_elapsed_units,
-    straight_line,
-    reducing_balance,
-    double_declining
+    cached_depreciation,
+    DECIMAL_BACKEND,
+    FORECAST_FREQUENCIES,
 )
+from .services.proration import compile_convention
+from .services.depreciation_runs import (
+    preview_period_depreciation,
+    run_period_depreciation,
+    stream_depreciation_preview,
+)
+from .services.lease_close import calculate_lease_rollforward, post_lease_journals
+from .services.portfolio import calculate_multi_book_depreciation, forecast_portfolio_nbv
 
 class CompanyViewSet(viewsets.ModelViewSet):
     queryset = Company.objects.all()
@@ -79,6 +87,23 @@ class DepreciationViewSet(viewsets.ModelViewSet):
     queryset = Depreciation.objects.all()
     serializer_class = DepreciationSerializer
 
+class DepreciationScheduleViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = DepreciationSchedule.objects.all()
+    serializer_class = DepreciationScheduleSerializer
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        params = self.request.query_params
+        if params.get('register'):
+            queryset = queryset.filter(register_id=params['register'])
+        if params.get('account'):
+            queryset = queryset.filter(register__account_id=params['account'])
+        if params.get('from'):
+            queryset = queryset.filter(period_end__gte=params['from'])
+        if params.get('to'):
+            queryset = queryset.filter(period_end__lte=params['to'])
+        return queryset
+
 class DepreciationEventViewSet(viewsets.ModelViewSet):
     queryset = DepreciationEvent.objects.all()
     serializer_class = DepreciationEventSerializer
@@ -105,41 +130,94 @@ class RoleViewSet(viewsets.ModelViewSet):
 
 
 class DepreciationCalculationAPI(APIView):
+    def calculate_from_data(self, data):
+        method = data.get("depreciation_method")
+        total_amount = Decimal(data.get("total_amount") or 0)
+        residual_value = Decimal(data.get("residual_value") or 0)
+        useful_life = int(data.get("useful_life") or 0)
+        period = data.get("period")
+        computation = data.get("computaion")
+        capitalization_date_str = data.get("capitalization_date")
+        capitalization_date = None
+        if capitalization_date_str:
+            capitalization_date = datetime.strptime(capitalization_date_str, "%Y-%m-%d").date()
+
+        return cached_depreciation(
+            method, total_amount, residual_value, useful_life, period, computation, capitalization_date,
+            self.get_as_of(data), self.get_backend(data), self.get_convention(data)
+        )
+
+    def get_as_of(self, data):
+        as_of = data.get("as_of")
+        if as_of:
+            return datetime.strptime(as_of, "%Y-%m-%d").date()
+        return None
+
+    def get_backend(self, data):
+        # Previews may opt into the float backend; the default stays exact.
+        return data.get("backend") or DECIMAL_BACKEND
+
+    def get_convention(self, data):
+        # Same default as the posting runs and the stored schedules.
+        if data.get("convention"):
+            return compile_convention(data["convention"])
+        return get_default_convention()
+
+    def calculate_registers(self, register_ids, as_of=None, backend=DECIMAL_BACKEND, convention=None):
+        assets = FixedAssetRegister.objects.filter(pk__in=register_ids).only(
+            'register_id', 'depreciation_method', 'total_amount', 'residual_value',
+            'useful_life', 'period', 'computation', 'capitalization_date'
+        )
+        assets = {asset.register_id: asset for asset in assets}
+
+        results = []
+        for register_id in register_ids:
+            asset = assets.get(register_id)
+            if asset is None:
+                results.append({"register_id": register_id, "error": "Asset not found"})
+                continue
+            try:
+                result = cached_depreciation(
+                    asset.depreciation_method,
+                    Decimal(str(asset.total_amount)),
+                    Decimal(str(asset.residual_value)),
+                    asset.useful_life,
+                    asset.period,
+                    asset.computation,
+                    asset.capitalization_date,
+                    as_of,
+                    backend,
+                    convention,
+                )
+            except Exception as e:
+                result = {"error": str(e)}
+            results.append({"register_id": register_id, **result})
+        return results
+
+    def calculate_batch(self, items):
+        results = []
+        for data in items:
+            try:
+                results.append(self.calculate_from_data(data))
+            except Exception as e:
+                results.append({"error": str(e)})
+        return results
+
     def post(self, request):
         try:
             data = request.data
-            method = data.get("depreciation_method")
-            total_amount = Decimal(data.get("total_amount") or 0)
-            residual_value = Decimal(data.get("residual_value") or 0)
-            useful_life = int(data.get("useful_life") or 0)
-            period = data.get("period")
-            computation = data.get("computaion")
-            capitalization_date_str = data.get("capitalization_date")
-            capitalization_date = None
-            if capitalization_date_str:
-                capitalization_date = datetime.strptime(capitalization_date_str, "%Y-%m-%d").date()
-
-
-            total_units = get_total_units(useful_life, period, computation)
-            elapsed_units = get_elapsed_units(capitalization_date, computation)
-            elapsed_units = min(elapsed_units, total_units)
-
-            if method == "Straight Line":
-                accumulated = straight_line(total_amount, residual_value, total_units, elapsed_units)
-            elif method == "Reducing Balance":
-                accumulated = reducing_balance(total_amount, residual_value, useful_life, elapsed_units, computation.upper())
-            else:
-                accumulated = double_declining(total_amount, residual_value, useful_life, elapsed_units, computation.upper())
 
-            current_nbv = max(total_amount - accumulated, residual_value)
+            if isinstance(data, list):
+                return Response({"results": self.calculate_batch(data)}, status=status.HTTP_200_OK)
 
-            return Response({
-                "depreciation_method": method,
-                "total_units": total_units,
-                "elapsed_units": elapsed_units,
-                "accumulated_depreciation": round(accumulated, 2),
-                "current_nbv": round(current_nbv, 2),
-            }, status=status.HTTP_200_OK)
+            if "register_ids" in data:
+                register_ids = [int(register_id) for register_id in data.get("register_ids") or []]
+                results = self.calculate_registers(
+                    register_ids, self.get_as_of(data), self.get_backend(data), self.get_convention(data)
+                )
+                return Response({"results": results}, status=status.HTTP_200_OK)
+
+            return Response(self.calculate_from_data(data), status=status.HTTP_200_OK)
         except Exception:
             return Response({"error": traceback.format_exc()}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -175,7 +253,12 @@ class FixedAssetFullDetailAPI(APIView):
         )  
 
         serializer = FixedAssetFullSerializer(asset)
-        return Response(serializer.data, status=status.HTTP_200_OK) 
+        data = serializer.data
+
+        as_of = request.query_params.get('as_of')
+        if as_of:
+            data['nbv_as_of'] = asset.get_nbv_at(datetime.strptime(as_of, "%Y-%m-%d").date())
+        return Response(data, status=status.HTTP_200_OK) 
 
 
 class ExecuteDepreciationAPI(APIView):
@@ -266,6 +349,208 @@ class ExecuteDepreciationAPI(APIView):
             return Response({'error': str(e), 'traceback': traceback.format_exc()}, 
                           status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+class PeriodEndDepreciationAPI(APIView):
+    permission_classes = [AllowAny]
+    def post(self, request):
+        try:
+            data = request.data
+            flags = PeriodEndDepreciationSerializer(data=data)
+            if not flags.is_valid():
+                return Response(flags.errors, status=status.HTTP_400_BAD_REQUEST)
+            flags = flags.validated_data
+
+            depreciation_date = data.get('depreciation_date')
+            if depreciation_date:
+                depreciation_date = datetime.strptime(depreciation_date, "%Y-%m-%d").date()
+
+            if flags['dry_run']:
+                output_format = data.get('format') or 'ndjson'
+                if output_format not in ('ndjson', 'csv'):
+                    return Response({'error': 'format must be ndjson or csv'},
+                                    status=status.HTTP_400_BAD_REQUEST)
+                rows = preview_period_depreciation(
+                    depreciation_date=depreciation_date,
+                    chunk_size=int(data.get('chunk_size') or 500),
+                    incremental=flags['incremental'],
+                )
+                return StreamingHttpResponse(
+                    stream_depreciation_preview(rows, output_format),
+                    content_type='text/csv' if output_format == 'csv' else 'application/x-ndjson',
+                )
+
+            report = run_period_depreciation(
+                user_id=data.get('user_id'),
+                depreciation_date=depreciation_date,
+                chunk_size=int(data.get('chunk_size') or 500),
+                show_in_journal=flags['show_in_journal'],
+                incremental=flags['incremental'],
+            )
+
+            return Response({
+                'success': True,
+                'message': 'Period-end depreciation executed successfully',
+                **report,
+            }, status=status.HTTP_201_CREATED)
+
+        except Users.DoesNotExist:
+            return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+        except Exception as e:
+            return Response({'error': str(e), 'traceback': traceback.format_exc()}, 
+                          status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+class PortfolioForecastAPI(APIView):
+    permission_classes = [AllowAny]
+    def get(self, request):
+        try:
+            params = request.query_params
+            frequency = (params.get('frequency') or 'MONTH').upper()
+            if frequency not in FORECAST_FREQUENCIES:
+                return Response({'error': 'frequency must be MONTH or YEAR'},
+                                status=status.HTTP_400_BAD_REQUEST)
+            periods = int(params.get('periods') or 12)
+            if periods < 1:
+                return Response({'error': 'periods must be positive'}, status=status.HTTP_400_BAD_REQUEST)
+            start = params.get('from')
+            if start:
+                start = datetime.strptime(start, "%Y-%m-%d").date()
+
+            queryset = FixedAssetRegister.objects.all()
+            if params.get('account'):
+                queryset = queryset.filter(account_id=params['account'])
+            if params.get('asset_group'):
+                queryset = queryset.filter(asset_group=params['asset_group'])
+
+            period_ends, register_ids, forecast = forecast_portfolio_nbv(queryset, periods, frequency, start)
+
+            totals = []
+            for index, period_end in enumerate(period_ends):
+                totals.append({
+                    'period_end': period_end,
+                    'period_charge': round(float(forecast['period_charge'][index].sum()), 2) if forecast else 0.0,
+                    'accumulated_depreciation': round(float(forecast['accumulated_depreciation'][index].sum()), 2) if forecast else 0.0,
+                    'nbv': round(float(forecast['nbv'][index].sum()), 2) if forecast else 0.0,
+                })
+
+            assets = []
+            if forecast and params.get('detail', 'true').lower() != 'false':
+                columns = {key: values.T.tolist() for key, values in forecast.items()}
+                for index, register_id in enumerate(register_ids):
+                    assets.append({
+                        'register_id': register_id,
+                        'period_charge': columns['period_charge'][index],
+                        'accumulated_depreciation': columns['accumulated_depreciation'][index],
+                        'nbv': columns['nbv'][index],
+                    })
+
+            return Response({
+                'frequency': frequency,
+                'period_ends': period_ends,
+                'totals': totals,
+                'assets': assets,
+            }, status=status.HTTP_200_OK)
+
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            return Response({'error': str(e), 'traceback': traceback.format_exc()}, 
+                          status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+class MultiBookDepreciationAPI(APIView):
+    permission_classes = [AllowAny]
+    def get(self, request):
+        try:
+            params = request.query_params
+            as_of = params.get('as_of')
+            if as_of:
+                as_of = datetime.strptime(as_of, "%Y-%m-%d").date()
+
+            queryset = FixedAssetRegister.objects.all()
+            if params.get('register'):
+                queryset = queryset.filter(register_id=params['register'])
+            if params.get('account'):
+                queryset = queryset.filter(account_id=params['account'])
+            if params.get('asset_group'):
+                queryset = queryset.filter(asset_group=params['asset_group'])
+
+            book_ids = [int(book_id) for book_id in params.getlist('book')]
+            results = calculate_multi_book_depreciation(queryset, as_of, book_ids)
+            return Response({'results': results}, status=status.HTTP_200_OK)
+
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            return Response({'error': str(e), 'traceback': traceback.format_exc()}, 
+                          status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+class LeaseRollForwardAPI(APIView):
+    permission_classes = [AllowAny]
+    def get(self, request):
+        try:
+            params = request.query_params
+            if not params.get('from') or not params.get('to'):
+                return Response({'error': 'from and to are required'}, status=status.HTTP_400_BAD_REQUEST)
+            start = datetime.strptime(params['from'], "%Y-%m-%d").date()
+            end = datetime.strptime(params['to'], "%Y-%m-%d").date()
+            if end < start:
+                return Response({'error': 'to must not be before from'}, status=status.HTTP_400_BAD_REQUEST)
+
+            queryset = LeaseFinancial.objects.all()
+            if params.get('status'):
+                queryset = queryset.filter(lease__status=params['status'])
+
+            ids, rollforward = calculate_lease_rollforward(start, end, queryset)
+
+            totals = {key: round(float(values.sum()), 2) for key, values in (rollforward or {}).items()}
+            leases = []
+            if rollforward and params.get('detail', 'true').lower() != 'false':
+                columns = {key: [round(value, 2) for value in values.tolist()] for key, values in rollforward.items()}
+                for index, (financial_id, lease_id) in enumerate(ids):
+                    leases.append({
+                        'financial_id': financial_id,
+                        'lease_id': lease_id,
+                        **{key: values[index] for key, values in columns.items()},
+                    })
+
+            return Response({
+                'from': start,
+                'to': end,
+                'totals': totals,
+                'leases': leases,
+            }, status=status.HTTP_200_OK)
+
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            return Response({'error': str(e), 'traceback': traceback.format_exc()}, 
+                          status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+class LeaseJournalPostingAPI(APIView):
+    permission_classes = [AllowAny]
+    def post(self, request):
+        try:
+            data = request.data
+            period_end = data.get('period_end')
+            period_end = datetime.strptime(period_end, "%Y-%m-%d").date() if period_end else timezone.localdate()
+            period_start = data.get('period_start')
+            if period_start:
+                period_start = datetime.strptime(period_start, "%Y-%m-%d").date()
+                if period_start > period_end:
+                    return Response({'error': 'period_start must not be after period_end'},
+                                    status=status.HTTP_400_BAD_REQUEST)
+
+            report = post_lease_journals(period_end, period_start, int(data.get('chunk_size') or 500))
+            return Response({
+                'success': True,
+                'message': 'Lease journals posted successfully',
+                **report,
+            }, status=status.HTTP_201_CREATED)
+
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            return Response({'error': str(e), 'traceback': traceback.format_exc()}, 
+                          status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 class WIPItemsAPI(APIView):
     def get(self, request, pk):
         wip_items = WIPItem.objects.filter(wip_id =pk)
@@ -371,6 +656,16 @@ class FixedAssetDepreciationAPI(APIView):
         serializer = DepreciationSerializer(depreciations, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
     
+class FixedAssetDepreciationScheduleAPI(APIView):
+    def get(self, request, pk):
+        schedule = DepreciationSchedule.objects.filter(register_id=pk)
+        if request.query_params.get('from'):
+            schedule = schedule.filter(period_end__gte=request.query_params['from'])
+        if request.query_params.get('to'):
+            schedule = schedule.filter(period_end__lte=request.query_params['to'])
+        serializer = DepreciationScheduleSerializer(schedule, many=True)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+    
 class FixedAssetPolicyAPI(APIView):
     def get(self, request, pk):
         asset_policies = AssetPolicy.objects.filter(register_id=pk)
@@ -639,12 +934,74 @@ class AssetCategoryPolicyViewSet(viewsets.ModelViewSet):
 
 
 
+class CPIIndexViewSet(viewsets.ModelViewSet):
+    queryset = CPIIndex.objects.all()
+    serializer_class = CPIIndexSerializer
+
+
+LEASE_SCHEDULE_ROWS = {'amortization_schedule': 'amortization_rows', 'rou_asset_schedule': 'rou_rows'}
+
+
+class LeaseSchedulePagination(PageNumberPagination):
+    page_size = 120
+    page_size_query_param = 'page_size'
+    max_page_size = 1200
+
+
 class LeaseContractViewSet(viewsets.ModelViewSet):
-    queryset = LeaseContract.objects.all()
+    queryset = LeaseContract.objects.select_related('financial')
     serializer_class = LeaseContractSerializer
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        for field in LeaseFinancialSerializer.requested_includes(self.request):
+            queryset = queryset.prefetch_related(f'financial__{LEASE_SCHEDULE_ROWS[field]}')
+        return queryset
     
 class LeaseFinancialViewSet(viewsets.ModelViewSet):
     present_value = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
     queryset = LeaseFinancial.objects.all()
     serializer_class = LeaseFinancialSerializer
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        for field in LeaseFinancialSerializer.requested_includes(self.request):
+            queryset = queryset.prefetch_related(LEASE_SCHEDULE_ROWS[field])
+        return queryset
+
+    def schedule_page(self, rows, compute):
+        # Stored rows are filtered in the database; leases saved before the
+        # schedules were persisted are computed and filtered in memory.
+        params = self.request.query_params
+        if rows.exists():
+            if params.get('period_from'):
+                rows = rows.filter(period__gte=int(params['period_from']))
+            if params.get('period_to'):
+                rows = rows.filter(period__lte=int(params['period_to']))
+            if params.get('from'):
+                rows = rows.filter(date__gte=params['from'])
+            if params.get('to'):
+                rows = rows.filter(date__lte=params['to'])
+        else:
+            rows = [
+                row for row in compute()
+                if (not params.get('period_from') or row['period'] >= int(params['period_from']))
+                and (not params.get('period_to') or row['period'] <= int(params['period_to']))
+                and (not params.get('from') or row['date'] >= params['from'])
+                and (not params.get('to') or row['date'] <= params['to'])
+            ]
+
+        paginator = LeaseSchedulePagination()
+        page = paginator.paginate_queryset(rows, self.request, view=self)
+        return paginator.get_paginated_response([row if isinstance(row, dict) else row.as_dict() for row in page])
+
+    @action(detail=True, methods=['get'], url_path='amortization-schedule')
+    def amortization_schedule(self, request, pk=None):
+        financial = self.get_object()
+        return self.schedule_page(financial.amortization_rows.all(), financial.get_amortization_schedule)
+
+    @action(detail=True, methods=['get'], url_path='rou-schedule')
+    def rou_schedule(self, request, pk=None):
+        financial = self.get_object()
+        return self.schedule_page(financial.rou_rows.all(), financial.get_rou_asset_schedule)
+